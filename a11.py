@@ -2,8 +2,25 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-from datetime import datetime
+from pandas.api.types import union_categoricals
+from datetime import datetime, time as dt_time
 import os
+import sys
+import json
+import hashlib
+import glob
+from urllib.parse import quote
+import threading
+import time
+import tempfile
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+import openpyxl
+import altair as alt
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from cachetools import LRUCache
 import warnings
 warnings.filterwarnings('ignore')  # 屏蔽无关警告
 
@@ -58,6 +75,22 @@ st.markdown("""
         font-weight: bold;
     }
     
+    /* 近似值标记：样本估计的结果，精确结果算完后替换 */
+    .approx-badge {
+        background-color: #fff3cd;
+        color: #856404;
+        border-radius: 4px;
+        font-size: 0.8rem;
+        padding: 0.1rem 0.4rem;
+        margin-left: 0.3rem;
+    }
+    
+    .metric-error {
+        color: #6c757d;
+        font-size: 1rem;
+        font-weight: normal;
+    }
+    
     /* 侧边栏样式：轻灰背景+内边距 */
     [data-testid="stSidebar"] {
         background-color: #f8f9fa;
@@ -87,124 +120,1793 @@ st.markdown("""
 
 
 # 3. 数据加载（核心修复：Excel读取+时间列容错）
-@st.cache_data(show_spinner="正在加载销售数据...")
+EXCEL_PATH = "supermarket_sales.xlsx"  # 当前代码所在目录的数据文件
+# 数据源：单个Excel文件，或按分店/月份拆分的多个文件所在的目录、通配符（如 exports/*.xlsx）
+DATA_SOURCE = os.environ.get("A11_DATA_SOURCE", EXCEL_PATH)
+PARTITION_SUFFIXES = (".xlsx", ".csv")
+SNAPSHOT_DIR = ".a11_cache"  # 清洗后数据的Parquet快照目录
+SNAPSHOT_FORMAT = 3  # 快照格式版本：清洗规则、列类型或attrs有变化时加1，旧版本的快照随即失效
+STREAM_CHUNK_ROWS = 20_000  # 流式读取时每块的行数（内存峰值与之成正比）
+
+# 字段100%映射你的Excel列名（避免KeyError）
+COLUMN_MAPPING = {
+    "分店": "branch",
+    "城市": "city",
+    "顾客类型": "customer_type",
+    "性别": "gender",
+    "产品类型": "category",
+    "单价": "unit_price",
+    "数量": "quantity",
+    "总价": "revenue",  # 你的"总价"即销售额
+    "日期": "date",
+    "时间": "time",
+    "评分": "rating"
+}
+
+
+TIME_FAST_FORMATS = ["%H:%M:%S", "%H:%M"]  # 先按固定格式解析，剩余的才自动识别
+
+
+def parse_time_column(values):
+    """
+    解析时间列，返回：(清洗后的时间文本[分类类型], 小时数组, 无法识别的行数)
+    1. 用查找表去重：每个不同的取值只解析一次，再按编码映射回每一行
+    2. Excel原生的datetime.time/datetime单元格直接取小时，不做字符串往返
+    3. 文本先删空格和特殊字符，依次尝试%H:%M:%S、%H:%M，剩余的才用format="mixed"
+    """
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object), use_na_sentinel=True)
+    uniques = np.asarray(uniques, dtype=object)
+    unique_hours = np.full(len(uniques), -1, dtype=np.int64)
+    unique_text = np.empty(len(uniques), dtype=object)
+
+    is_native = np.array([isinstance(v, (datetime, dt_time)) for v in uniques], dtype=bool)
+    for i in np.flatnonzero(is_native):
+        unique_hours[i] = uniques[i].hour
+        unique_text[i] = uniques[i].strftime("%H:%M:%S")
+
+    pending = np.flatnonzero(~is_native)
+    if len(pending):
+        # 清理时间列脏数据（空格、特殊字符）
+        text = pd.Series(uniques[pending], dtype=object).astype(str).str.strip()
+        text = text.str.replace(r"[^\d:]", "", regex=True)
+        unique_text[pending] = text.to_numpy()
+        parsed = pd.Series(pd.NaT, index=text.index, dtype="datetime64[ns]")
+        for fmt in TIME_FAST_FORMATS + ["mixed"]:
+            missing = parsed.isna()
+            if not missing.any():
+                break
+            parsed[missing] = pd.to_datetime(text[missing], format=fmt, errors="coerce")
+        unique_hours[pending] = parsed.dt.hour.fillna(-1).astype(np.int64).to_numpy()
+
+    # 映射回每一行：空单元格与无法识别的时间都记为失败
+    row_hours = np.where(codes >= 0, unique_hours[codes], -1)
+    failed = row_hours < 0
+    text_codes, text_categories = pd.factorize(unique_text)
+    row_text_codes = np.where(codes >= 0, text_codes[codes], -1)
+    time_text = pd.Categorical.from_codes(row_text_codes, categories=text_categories)
+    return time_text, np.where(failed, 0, row_hours), int(failed.sum())
+
+
+def clean_sales_frame(df):
+    """把原始Excel表转换为标准字段：列名映射 + 时间列容错 + 小时提取 + 日期转换"""
+    df_standard = df.rename(columns=COLUMN_MAPPING)
+
+    # 核心修复：时间列格式容错（解决ValueError）
+    # 每个不同的时间只解析一次；无法识别的时间小时记为0（避免后续图表报错），并统计条数
+    time_text, hours, n_failed = parse_time_column(df_standard["time"])
+    df_standard["time"] = time_text
+    df_standard["hour"] = hours
+    df_standard.attrs["time_parse_failures"] = n_failed
+
+    # 日期列转换（确保筛选器正常）
+    df_standard["date"] = pd.to_datetime(df_standard["date"], errors="coerce")
+    return df_standard
+
+
+# 紧凑存储：字符串维度→分类类型，数值列→更窄的类型
+CATEGORICAL_COLUMNS = ["branch", "city", "customer_type", "gender", "category", "time"]
+FLOAT32_COLUMNS = ["unit_price", "revenue", "rating"]
+SMALL_INT_COLUMNS = ["quantity", "hour"]
+
+
+def compact_sales_frame(df_standard):
+    """
+    把清洗后的数据转换为紧凑类型，并把前后内存占用记录到 df.attrs["memory_report"]
+    （attrs会随Parquet快照一起保存）
+    逐列转换后组成新表，不先复制整表；不需要转换的列与输入共享数组（输入随后即被丢弃）
+    """
+    before = int(df_standard.memory_usage(index=False, deep=True).sum())
+    columns = {}
+    for column in df_standard.columns:
+        values = df_standard[column]
+        if column in CATEGORICAL_COLUMNS and not isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype("category")
+        elif column in FLOAT32_COLUMNS:
+            values = pd.to_numeric(values, errors="coerce").astype(np.float32, copy=False)
+        elif column in SMALL_INT_COLUMNS and values.notna().all():
+            # 有空值的整数列保持原样，避免整数类型无法表示NaN
+            values = pd.to_numeric(values, downcast="integer")
+        columns[column] = values
+    df_compact = pd.DataFrame(columns, index=df_standard.index, copy=False)
+    df_compact.attrs = dict(df_standard.attrs)
+    after = int(df_compact.memory_usage(index=False, deep=True).sum())
+    df_compact.attrs["memory_report"] = {"before": before, "after": after, "saved": before - after}
+    return df_compact
+
+
+def _source_signature(excel_path):
+    """数据文件的身份标识：绝对路径 + 文件大小 + 修改时间"""
+    stat = os.stat(excel_path)
+    return {
+        "path": os.path.abspath(excel_path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+
+
+def _snapshot_path(excel_path):
+    """每个数据文件对应一个快照文件（按绝对路径哈希命名）"""
+    digest = hashlib.sha1(os.path.abspath(excel_path).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(SNAPSHOT_DIR, f"sales_{digest}.parquet")
+
+
+def resolve_data_files(source=DATA_SOURCE):
+    """把数据源解析为文件列表：单个文件、目录下的全部xlsx/csv、或通配符匹配的文件"""
+    if os.path.isdir(source):
+        paths = glob.glob(os.path.join(source, "*"))
+    elif glob.has_magic(source):
+        paths = glob.glob(source)
+    else:
+        return [source] if os.path.isfile(source) else []
+    return sorted(
+        path for path in paths
+        if path.lower().endswith(PARTITION_SUFFIXES)
+        and not os.path.basename(path).startswith("~$")  # 跳过Excel打开时的锁文件
+        and os.path.isfile(path)
+    )
+
+
+def dataset_version(source=DATA_SOURCE):
+    """
+    数据版本号：文件标识的JSON文本，作为各级缓存的键（找不到数据文件时返回None）
+    单个文件 → 该文件的标识；目录/通配符 → {"partitions": 每个文件的标识}
+    """
+    files = resolve_data_files(source)
+    if not files:
+        return None
+    if os.path.isfile(source):
+        return json.dumps(_source_signature(source), sort_keys=True)
+    return json.dumps({"partitions": [_source_signature(path) for path in files]}, sort_keys=True)
+
+
+def read_snapshot(excel_path):
+    """
+    读取Parquet快照（内存映射），返回 (DataFrame, 快照对应的文件标识)
+    快照缺失、损坏或格式版本与SNAPSHOT_FORMAT不一致（由旧版本代码写入）时返回 (None, None)
+    """
+    snapshot_path = _snapshot_path(excel_path)
+    if not os.path.exists(snapshot_path):
+        return None, None
+    try:
+        metadata = pq.read_schema(snapshot_path).metadata or {}
+        signature = json.loads(metadata.get(b"a11_source", b"{}"))
+        if signature.pop("format", None) != SNAPSHOT_FORMAT:
+            return None, None  # 旧格式的快照：列类型和attrs可能不完整，也不能用于增量刷新
+        table = pq.read_table(snapshot_path, memory_map=True)
+    except (OSError, ValueError, pa.ArrowException):
+        return None, None  # 快照损坏时回退到解析Excel
+    return table.to_pandas(), signature
+
+
+def load_snapshot(excel_path):
+    """读取与当前Excel一致的快照，快照缺失或与Excel的大小/修改时间不一致时返回None"""
+    df_snapshot, signature = read_snapshot(excel_path)
+    if signature != _source_signature(excel_path):
+        return None  # Excel已更新，快照失效
+    return df_snapshot
+
+
+def save_snapshot(df_standard, excel_path):
+    """把清洗后的数据写成Parquet快照（先写临时文件再原子替换），失败不影响主流程"""
+    snapshot_path = _snapshot_path(excel_path)
+    try:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        table = pa.Table.from_pandas(df_standard, preserve_index=False)
+        metadata = dict(table.schema.metadata or {})
+        source = {**_source_signature(excel_path), "format": SNAPSHOT_FORMAT}
+        metadata[b"a11_source"] = json.dumps(source).encode("utf-8")
+        table = table.replace_schema_metadata(metadata)
+        tmp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, snapshot_path)
+    except (OSError, pa.ArrowException):
+        return False
+    return True
+
+
+def _update_fingerprint(digest, row_number, row):
+    """把一行原始数据（连同行号）累加进指纹，用于确认增量刷新时旧数据没有任何改动"""
+    digest.update(json.dumps([row_number, row], default=str, ensure_ascii=False).encode("utf-8"))
+
+
+def iter_excel_chunks(excel_path, chunk_rows=STREAM_CHUNK_ROWS, header_row=2, after_row=None, expected_fingerprint=None):
+    """
+    以openpyxl只读模式逐行遍历工作表，每chunk_rows行产出 (原始DataFrame分块, 最后一行的行号, 截至该行的指纹)
+    指纹是列名与此前所有非空行（含行号）的累计哈希
+    header_row：列名所在行（第1行是"2022年前3个月销售数据"标题）
+    after_row/expected_fingerprint：增量读取时只清点该行号之后的新行；此前的旧行只参与指纹计算，
+    指纹与上次不一致（旧行被修改、删除或移动）时抛出ValueError
+    """
+    workbook = openpyxl.load_workbook(excel_path, read_only=True, data_only=True)
+    try:
+        # 与pd.read_excel(sheet_name=0)一致：读第一个工作表，而不是保存时恰好处于活动状态的工作表
+        rows = workbook.worksheets[0].iter_rows(min_row=header_row, values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [name if name is not None else f"Unnamed: {i}" for i, name in enumerate(header)]
+        digest = hashlib.sha1()
+        _update_fingerprint(digest, header_row, header)
+
+        def check_old_rows():
+            if digest.hexdigest() != expected_fingerprint:
+                raise ValueError("工作表中已有的数据被修改，无法增量追加")
+
+        chunk = []
+        old_checked = after_row is None
+        for row_number, row in enumerate(rows, start=header_row + 1):
+            if all(value is None for value in row):
+                continue  # 跳过空行（与pd.read_excel一致）
+            if not old_checked and row_number > after_row:
+                check_old_rows()
+                old_checked = True
+            _update_fingerprint(digest, row_number, row)
+            if not old_checked:
+                continue  # 旧数据只计入指纹，不构建分块、不清洗
+            chunk.append(row)
+            if len(chunk) >= chunk_rows:
+                yield pd.DataFrame.from_records(chunk, columns=columns), row_number, digest.hexdigest()
+                chunk = []
+        if not old_checked:
+            check_old_rows()
+        if chunk:
+            yield pd.DataFrame.from_records(chunk, columns=columns), row_number, digest.hexdigest()
+    finally:
+        workbook.close()
+
+
+def load_excel_streaming(excel_path, chunk_rows=STREAM_CHUNK_ROWS, after_row=None, expected_fingerprint=None):
+    """
+    流式读取Excel：逐块清洗（时间清理、小时提取、日期转换）并转换为紧凑类型（维度列→分类，数值列→窄类型）后，
+    再追加到按列的缓冲区，缓冲区中不保留维度列的object数组；返回的数据已是紧凑类型，并带有memory_report
+    after_row/expected_fingerprint：只读取上次快照之后新增的行（见iter_excel_chunks）
+    """
+    buffers = {}  # 列名 → 各分块紧凑后的数组（分类列保持Categorical）
+    time_parse_failures = 0
+    memory_before = 0  # 各分块紧凑前的内存占用之和
+    last_sheet_row, rows_fingerprint = after_row, expected_fingerprint
+    for raw_chunk, last_sheet_row, rows_fingerprint in iter_excel_chunks(
+        excel_path, chunk_rows, after_row=after_row, expected_fingerprint=expected_fingerprint
+    ):
+        chunk = compact_sales_frame(clean_sales_frame(raw_chunk))
+        time_parse_failures += chunk.attrs["time_parse_failures"]
+        memory_before += chunk.attrs["memory_report"]["before"]
+        for column in chunk.columns:
+            values = chunk[column]
+            is_categorical = isinstance(values.dtype, pd.CategoricalDtype)
+            # 非分类列复制一份：to_numpy()可能是分块二维object块的视图，会让整块原始单元格对象一直留在内存中
+            buffers.setdefault(column, []).append(values.array if is_categorical else values.to_numpy(copy=True))
+        del raw_chunk, chunk
+
+    if not buffers:
+        return pd.DataFrame()
+
+    # 逐列合并，合并完立即释放该列的分块，峰值只多出一列的分块
+    data = {}
+    for column in list(buffers):
+        parts = buffers.pop(column)
+        if isinstance(parts[0], pd.Categorical):
+            data[column] = union_categoricals(parts, sort_categories=True)
+        else:
+            data[column] = np.concatenate(parts) if len(parts) > 1 else parts[0]
+        del parts
+    df_standard = pd.DataFrame(data, copy=False)
+    df_standard.attrs["time_parse_failures"] = time_parse_failures
+    memory_after = int(df_standard.memory_usage(index=False, deep=True).sum())
+    df_standard.attrs["memory_report"] = {"before": memory_before, "after": memory_after, "saved": memory_before - memory_after}
+    # 记录最后一行的位置和全部行的指纹，供下次增量刷新使用（attrs随快照保存）
+    df_standard.attrs["last_sheet_row"] = last_sheet_row
+    df_standard.attrs["rows_fingerprint"] = rows_fingerprint
+    return df_standard
+
+
+def concat_sales_frames(frames):
+    """按列拼接多个清洗后的数据（列取并集）：分类列合并取值（union_categoricals），避免退化成object"""
+    frames = [frame for frame in frames if len(frame)]
+    if not frames:
+        return pd.DataFrame()
+    if len(frames) == 1:
+        return frames[0].copy()
+    columns = list(dict.fromkeys(column for frame in frames for column in frame.columns))
+    data = {}
+    for column in columns:
+        # 某个分区缺少的列用空值补齐
+        parts = [frame[column] if column in frame else pd.Series(np.nan, index=frame.index) for frame in frames]
+        if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            data[column] = union_categoricals([part.array for part in parts], sort_categories=True)
+        else:
+            data[column] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(data)
+
+
+def refresh_from_snapshot(excel_path):
+    """
+    Excel更新后的增量刷新：确认旧快照覆盖的各行都没有改动（累计指纹一致，计算指纹只需逐行读取，不清洗），
+    只清洗其后新增的行，再与旧快照拼接。任何旧行被修改、删除或移动（不是单纯追加）时返回None，由调用方全量重建
+    """
+    previous, signature = read_snapshot(excel_path)
+    if previous is None or previous.attrs.get("last_sheet_row") is None:
+        return None
+    try:
+        df_tail = load_excel_streaming(
+            excel_path,
+            after_row=previous.attrs["last_sheet_row"],
+            expected_fingerprint=previous.attrs.get("rows_fingerprint"),
+        )
+    except ValueError:
+        return None
+    if df_tail.empty:
+        df_standard = previous
+    else:
+        df_standard = concat_sales_frames([previous, df_tail])
+        df_standard.attrs = dict(previous.attrs)
+        df_standard.attrs["time_parse_failures"] = (
+            previous.attrs.get("time_parse_failures", 0) + df_tail.attrs["time_parse_failures"]
+        )
+        df_standard.attrs["last_sheet_row"] = df_tail.attrs["last_sheet_row"]
+        df_standard.attrs["rows_fingerprint"] = df_tail.attrs["rows_fingerprint"]
+        if "memory_report" in previous.attrs:
+            before = previous.attrs["memory_report"]["before"] + df_tail.attrs["memory_report"]["before"]
+            after = int(df_standard.memory_usage(index=False, deep=True).sum())
+            df_standard.attrs["memory_report"] = {"before": before, "after": after, "saved": before - after}
+    # 记录增量来源：预聚合结果可以在旧版本的基础上只加上新增的行
+    df_standard.attrs["increment"] = {
+        "base_version": json.dumps(signature, sort_keys=True),
+        "base_rows": len(previous),
+    }
+    return df_standard
+
+
+def read_sales_csv(csv_path):
+    """读取CSV导出：兼容带/不带"2022年前3个月销售数据"标题行、UTF-8/GBK两种编码"""
+    for encoding in ("utf-8-sig", "gb18030"):
+        try:
+            with open(csv_path, encoding=encoding) as f:
+                first_line = f.readline()
+            # 第一行就包含列名时不跳过
+            header = 0 if any(name in first_line for name in list(COLUMN_MAPPING) + list(COLUMN_MAPPING.values())) else 1
+            return pd.read_csv(csv_path, encoding=encoding, header=header)
+        except UnicodeDecodeError:
+            continue
+    raise ValueError(f"无法识别CSV文件编码：{csv_path}")
+
+
+def load_sales_file(path):
+    """
+    加载单个数据文件（不依赖Streamlit，可在子进程中运行）：
+    1. 快照与文件一致 → 直接读取快照，跳过解析
+    2. Excel只是在末尾追加了新行 → 只清洗新增的行并与快照拼接
+    3. 其他情况 → 全量读取并清洗（Excel用只读模式分块读取）
+    """
+    df_standard = load_snapshot(path)
+    if df_standard is None:
+        if path.lower().endswith(".csv"):
+            df_standard = compact_sales_frame(clean_sales_frame(read_sales_csv(path)))
+        else:
+            df_standard = refresh_from_snapshot(path)
+            if df_standard is None:
+                # 读取Excel：跳过第一行（"2022年前3个月销售数据"），用第二行做列名
+                df_standard = load_excel_streaming(path)  # 已逐块转换为紧凑类型
+        save_snapshot(df_standard, path)
+    return df_standard
+
+
+def load_partitioned_dataset(paths, max_workers=None):
+    """
+    并行加载多个分区文件（每个分店/月份一个导出文件），对齐为标准字段后拼接，
+    并增加partition列（文件名）。每个分区各自使用快照，只有变化的文件才会重新解析
+    """
+    max_workers = min(len(paths), max_workers or os.cpu_count() or 1)
+    if max_workers > 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            frames = list(pool.map(load_sales_file, paths))
+    else:
+        frames = [load_sales_file(path) for path in paths]
+
+    for path, frame in zip(paths, frames):
+        stem = os.path.splitext(os.path.basename(path))[0]
+        frame["partition"] = pd.Categorical.from_codes(np.zeros(len(frame), dtype=np.int8), categories=[stem])
+
+    df_standard = concat_sales_frames(frames)
+    df_standard.attrs = {
+        "n_partitions": len(paths),
+        "time_parse_failures": sum(f.attrs.get("time_parse_failures", 0) for f in frames),
+    }
+    if all("memory_report" in f.attrs for f in frames):
+        before = sum(f.attrs["memory_report"]["before"] for f in frames)
+        after = int(df_standard.memory_usage(index=False, deep=True).sum())
+        df_standard.attrs["memory_report"] = {"before": before, "after": after, "saved": before - after}
+    return df_standard
+
+
 def load_excel_data():
     """
-    读取本地Excel文件（supermarket_sales.xlsx）
+    读取本地Excel文件（默认supermarket_sales.xlsx，也可以通过A11_DATA_SOURCE指定多个分区文件）
     修复点：1. 跳过标题行 2. 时间列格式容错 3. 字段精准映射
+    优化：按数据版本（文件的路径、大小、修改时间）缓存，文件更新后自动刷新
+    返回 (数据, 数据版本)：本次运行的立方体、位图、缓存等都要用同一个版本，不能再次读取文件标识
+    （两次读取之间Excel可能被追加，数据与汇总就会对应不同的版本）
     """
     # 确认文件路径（当前代码所在目录）
-    excel_path = "supermarket_sales.xlsx"
-    if not os.path.exists(excel_path):
-        st.error(f"❌ 未找到数据文件：{excel_path}")
+    version = dataset_version(DATA_SOURCE)
+    if version is None:
+        st.error(f"❌ 未找到数据文件：{DATA_SOURCE}")
         st.info("💡 请确保Excel文件与代码放在同一目录")
-        return pd.DataFrame()  # 空表兜底，避免崩溃
+        return pd.DataFrame(), None  # 空表兜底，避免崩溃
+    df_standard = _load_excel_data(version)
+
+    st.success(f"✅ 数据加载成功！共{len(df_standard)}条销售记录")
+    n_partitions = df_standard.attrs.get("n_partitions")
+    if n_partitions:
+        st.info(f"🗂️ 已合并{n_partitions}个分区文件")
+    n_failed = df_standard.attrs.get("time_parse_failures", 0)
+    if n_failed:
+        st.warning(f"⚠️ 有{n_failed}条记录的时间无法识别，已按0点计入按小时统计")
+    report = df_standard.attrs.get("memory_report")
+    if report:
+        st.caption(
+            f"💾 内存占用 {report['after'] / 1024 ** 2:.2f} MB"
+            f"（紧凑类型节省 {report['saved'] / 1024 ** 2:.2f} MB，"
+            f"原为 {report['before'] / 1024 ** 2:.2f} MB）"
+        )
+    return df_standard, version
+
+
+@st.cache_resource(show_spinner="正在加载销售数据...", max_entries=2)
+def _load_excel_data(version):
+    """
+    按数据版本加载（只返回数据，提示信息由load_excel_data显示）：
+    单个文件直接加载，多个分区文件并行加载后拼接，最后按日期排序
+    所有会话与立方体/位图/内核的构建共享同一份只读数据（cache_data每次调用都会反序列化出一份副本）
+    """
+    source = json.loads(version)
+    if "partitions" in source:
+        df_standard = load_partitioned_dataset([p["path"] for p in source["partitions"]])
+    else:
+        df_standard = load_sales_file(source["path"])
+    return freeze_frame(sort_by_date(df_standard))
+
+
+def freeze_frame(df_standard):
+    """
+    把各列的底层数组设为只读，得到可以在会话间共享的数据：
+    数值/日期列直接冻结numpy数组（不复制），分类列沿用只读的编码数组；
+    文本列（如订单号）转换为Arrow字符串（缓冲区本身不可变，且比object数组省内存），
+    其他object列保持原样（只读的object数组会让memory_usage(deep=True)报错）
+    冻结只能拦住对已有列数组的原地修改（df.iloc[...] = ...、fillna(inplace=True)等）；
+    新增或替换整列（df["x"] = ...）修改的是共享的DataFrame对象本身，仍会影响所有会话，
+    需要加列时先 df.copy(deep=False) 再修改副本
+    """
+    columns = {}
+    for column in df_standard.columns:
+        series = df_standard[column]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            codes = series.cat.codes.to_numpy()  # 只读视图，与原编码共享内存
+            columns[column] = pd.Categorical.from_codes(codes, dtype=series.dtype, validate=False)
+        elif series.dtype == object:
+            if pd.api.types.infer_dtype(series, skipna=True) in ("string", "empty"):
+                columns[column] = pd.array(series, dtype="string[pyarrow]")
+            else:
+                columns[column] = series.to_numpy()
+        else:
+            values = series.to_numpy()
+            values.flags.writeable = False
+            columns[column] = values
+    df_frozen = pd.DataFrame(columns, index=df_standard.index, copy=False)
+    df_frozen.attrs = df_standard.attrs
+    return df_frozen
+
+
+def sort_by_date(df_standard):
+    """
+    按日期稳定排序（空日期排在最后），使任意日期区间都对应一段连续的行
+    快照保持Excel中的行序（便于增量追加），排序只在内存中进行；
+    增量刷新时记录新增行排序后的位置，供立方体只累加新增行
+    """
+    if df_standard.empty or "date" not in df_standard:
+        return df_standard
+    order = np.argsort(df_standard["date"].to_numpy(), kind="stable")  # NaT排在最后
+    attrs = dict(df_standard.attrs)
+    if not np.array_equal(order, np.arange(len(order))):
+        df_standard = df_standard.take(order).reset_index(drop=True)
+    increment = attrs.get("increment")
+    if increment:
+        attrs["increment"] = {**increment, "delta_positions": np.flatnonzero(order >= increment["base_rows"])}
+    df_standard.attrs = attrs
+    return df_standard
 
-    # 读取Excel：跳过第一行（"2022年前3个月销售数据"），用第二行做列名
-    df = pd.read_excel(
-        excel_path,
-        engine="openpyxl",  # 匹配你的openpyxl==3.1.5
-        header=1  # 关键：跳过标题行，解决Unnamed列问题
+
+def count_valid_dates(dates):
+    """已排序日期列中非空日期的行数（NaT都在末尾，二分查找即可）"""
+    return int(np.searchsorted(dates, np.datetime64("NaT", "ns"), side="left"))
+
+
+def date_slice(dates, start, end):
+    """
+    在已排序的日期列上二分查找 [start, end] 两天之间的行，返回连续的行区间 slice(lo, hi)
+    dates：按日期排序后的datetime64数组（NaT在末尾，不参与查找）
+    """
+    valid = dates[:count_valid_dates(dates)]
+    lo = int(np.searchsorted(valid, np.datetime64(start, "ns"), side="left"))
+    hi = int(np.searchsorted(valid, np.datetime64(end, "ns") + np.timedelta64(1, "D"), side="left"))
+    return slice(lo, hi)
+
+
+# 3.1 预聚合立方体（筛选维度 × 图表分组维度）
+CUBE_DIMENSIONS = ["city", "customer_type", "gender", "hour", "category"]
+FILTER_DIMENSIONS = ["city", "customer_type", "gender"]  # 侧边栏的3个筛选项
+CUBE_MAX_CELLS = 5_000_000  # 立方体单元格上限，超出时回退到逐行筛选
+
+
+def build_sales_cube(df, dimensions=CUBE_DIMENSIONS, mask=None):
+    """
+    按给定维度构建稠密立方体，每个单元格保存：
+    订单数、销售额之和/非空数、评分之和/非空数（空值不计入均值，与pandas的mean一致）
+    mask：可选的行掩码，只汇总被选中的行（不生成筛选后的DataFrame）
+    """
+    labels = {}
+    codes = []
+    for dim in dimensions:
+        dim_codes, uniques = pd.factorize(df[dim], sort=True, use_na_sentinel=False)
+        labels[dim] = list(uniques)
+        codes.append(dim_codes if mask is None else dim_codes[mask])
+    shape = tuple(len(labels[dim]) for dim in dimensions)
+    size = int(np.prod(shape))
+    flat = np.ravel_multi_index(codes, shape) if len(codes[0]) else np.zeros(0, dtype=np.intp)
+
+    measures = {"orders": np.bincount(flat, minlength=size)}
+    for column in ("revenue", "rating"):
+        values = df[column].to_numpy(dtype=float)
+        if mask is not None:
+            values = values[mask]
+        valid = ~np.isnan(values)
+        # 空输入时bincount返回整数数组，统一为浮点
+        measures[column] = np.bincount(flat[valid], weights=values[valid], minlength=size).astype(float)
+        measures[f"{column}_n"] = np.bincount(flat[valid], minlength=size)
+
+    return {
+        "dimensions": list(dimensions),
+        "labels": labels,
+        "index": {dim: {value: i for i, value in enumerate(labels[dim])} for dim in dimensions},
+        "measures": {name: values.reshape(shape) for name, values in measures.items()},
+    }
+
+
+def query_sales_cube(cube, selections):
+    """
+    按侧边栏选择切片并求和，返回 小时×产品类型 的二维度量
+    selections：{筛选维度: 选中的取值列表}，未出现在立方体里的维度不参与切片
+    """
+    return {
+        "hours": cube["labels"]["hour"],
+        "categories": cube["labels"]["category"],
+        **slice_cube(cube, selections, keep=("hour", "category")),
+    }
+
+
+def slice_cube(cube, selections, keep):
+    """按选择切片，并对keep以外的维度求和，返回各度量（保留keep维度）"""
+    slicers = []
+    for dim in cube["dimensions"]:
+        if dim in selections:
+            lookup = cube["index"][dim]
+            slicers.append([lookup[v] for v in selections[dim] if v in lookup])
+        else:
+            slicers.append(list(range(len(cube["labels"][dim]))))
+
+    filter_axes = tuple(i for i, dim in enumerate(cube["dimensions"]) if dim not in keep)
+    grid = np.ix_(*slicers)
+    return {name: values[grid].sum(axis=filter_axes) for name, values in cube["measures"].items()}
+
+
+GRID_MEASURES = ("orders", "revenue", "revenue_n", "rating", "rating_n")
+
+
+def summarize_aggregate(agg):
+    """由 小时×产品类型 的度量得到3个KPI和2个图表所需的数据"""
+    orders = int(agg["orders"].sum())
+    revenue_n = agg["revenue_n"].sum()
+    rating_n = agg["rating_n"].sum()
+    total_revenue = agg["revenue"].sum()
+
+    # 与groupby一致：只保留有订单的分组，空值分组不参与图表
+    hour_orders = agg["orders"].sum(axis=1)
+    hour_sales = pd.DataFrame({"hour": agg["hours"], "revenue": agg["revenue"].sum(axis=1)})
+    hour_sales = hour_sales[(hour_orders > 0) & hour_sales["hour"].notna()].reset_index(drop=True)
+
+    category_orders = agg["orders"].sum(axis=0)
+    category_sales = pd.Series(agg["revenue"].sum(axis=0), index=pd.Index(agg["categories"], name="category"), name="revenue")
+    category_sales = category_sales[(category_orders > 0) & category_sales.index.notna()]
+    category_sales = category_sales.sort_values(ascending=False).reset_index()
+
+    summary = {
+        "orders": orders,
+        "total_revenue": total_revenue,
+        "avg_rating": agg["rating"].sum() / rating_n if rating_n else float("nan"),
+        "avg_order": total_revenue / revenue_n if revenue_n else float("nan"),
+        "hour_sales": hour_sales,
+        "category_sales": category_sales,
+        # 保留 小时×产品类型 网格，图表交叉筛选直接在网格上重新汇总
+        "grid": {name: agg[name] for name in ("hours", "categories") + GRID_MEASURES},
+    }
+    if "days" in agg:
+        # 每日销售额（趋势图用）：区间内没有订单的日期记为0，空日期不参与
+        daily_sales = pd.DataFrame({"date": agg["days"], "revenue": agg["daily_revenue"]})
+        summary["daily_sales"] = daily_sales[daily_sales["date"].notna()].reset_index(drop=True)
+    return summary
+
+
+def _sorted_labels(values):
+    """维度取值排序（与factorize(sort=True)一致：空值排在最后）"""
+    present = [v for v in values if not pd.isna(v)]
+    missing = [v for v in values if pd.isna(v)][:1]  # 保留原有的空值（NaN/NaT）
+    return sorted(present) + missing
+
+
+def _merge_labels(base, delta):
+    """
+    两个立方体（或前缀和索引）的维度取值取并集；返回 (新的取值, grid_of)，
+    grid_of(来源) 给出来源的各取值在新取值中的位置网格（np.ix_）
+    """
+    dimensions = base["dimensions"]
+    labels = {}
+    for dim in dimensions:
+        known = {None if pd.isna(v) else v for v in base["labels"][dim]}
+        extra = [v for v in delta["labels"][dim] if (None if pd.isna(v) else v) not in known]
+        labels[dim] = _sorted_labels(base["labels"][dim] + extra) if extra else base["labels"][dim]
+
+    positions = {dim: {None if pd.isna(v) else v: i for i, v in enumerate(labels[dim])} for dim in dimensions}
+
+    def grid_of(cube):
+        return np.ix_(*[[positions[dim][None if pd.isna(v) else v] for v in cube["labels"][dim]] for dim in dimensions])
+
+    return labels, grid_of
+
+
+def merge_sales_cubes(base, delta):
+    """把增量立方体加到基础立方体上，维度取值取并集；返回新立方体，不修改base"""
+    dimensions = base["dimensions"]
+    labels, grid_of = _merge_labels(base, delta)
+    shape = tuple(len(labels[dim]) for dim in dimensions)
+    base_grid, delta_grid = grid_of(base), grid_of(delta)
+    measures = {}
+    for name, values in base["measures"].items():
+        merged = np.zeros(shape, dtype=values.dtype)
+        merged[base_grid] += values
+        merged[delta_grid] += delta["measures"][name]
+        measures[name] = merged
+    return {
+        "dimensions": list(dimensions),
+        "labels": labels,
+        "index": {dim: {value: i for i, value in enumerate(labels[dim])} for dim in dimensions},
+        "measures": measures,
+    }
+
+
+@st.cache_resource
+def _cube_registry(kind):
+    """进程级登记表（每种预聚合一张）：数据版本 → 已构建的结果，供增量刷新时在旧结果上累加"""
+    return {}
+
+
+def build_incrementally(kind, version, df, build, merge):
+    """
+    Excel只是追加了新行时，在上一版本的结果上只合并新增行：merge(旧结果, build(新增行))；
+    否则 build(全部行)。登记表只保留最新版本
+    """
+    registry = _cube_registry(kind)
+    increment = df.attrs.get("increment")
+    base = registry.get(increment["base_version"]) if increment else None
+    if base is not None:
+        result = merge(base, build(df.iloc[increment["delta_positions"]]))
+    else:
+        result = build(df)
+    registry.clear()
+    if result is not None:
+        registry[version] = result
+    return result
+
+
+@st.cache_resource(show_spinner="正在构建汇总立方体...", max_entries=2)
+def load_sales_cube(version):
+    """
+    每个数据版本只构建一次立方体（所有会话共享，只读），单元格过多时返回None
+    Excel只是追加了新行时，在上一版本的立方体上只累加新增行
+    """
+    df = _load_excel_data(version)
+    if df.empty:
+        return None
+    n_cells = np.prod([df[dim].nunique(dropna=False) for dim in CUBE_DIMENSIONS])
+    if n_cells > CUBE_MAX_CELLS:
+        return None
+    return build_incrementally("sales", version, df, build_sales_cube, merge_sales_cubes)
+
+
+DAILY_DIMENSIONS = FILTER_DIMENSIONS + ["date"]  # 每日立方体：筛选维度 × 日期
+
+
+@st.cache_resource(show_spinner="正在构建每日汇总...", max_entries=2)
+def load_daily_cube(version):
+    """
+    每个数据版本只构建一次 筛选维度×日期 的立方体（所有会话共享，只读），单元格过多时返回None
+    追加新行时与汇总立方体一样，只把新增行的立方体合并进上一版本
+    """
+    df = _load_excel_data(version)
+    if df.empty:
+        return None
+    n_cells = np.prod([df[dim].nunique(dropna=False) for dim in DAILY_DIMENSIONS])
+    if n_cells > CUBE_MAX_CELLS:
+        return None
+    return build_incrementally(
+        "daily", version, df, lambda rows: build_sales_cube(rows, DAILY_DIMENSIONS), merge_sales_cubes
     )
 
-    # 字段100%映射你的Excel列名（避免KeyError）
-    df_standard = df.rename(columns={
-        "分店": "branch",
-        "城市": "city",
-        "顾客类型": "customer_type",
-        "性别": "gender",
-        "产品类型": "category",
-        "单价": "unit_price",
-        "数量": "quantity",
-        "总价": "revenue",  # 你的"总价"即销售额
-        "日期": "date",
-        "时间": "time",
-        "评分": "rating"
-    })
 
-    # 核心修复：时间列格式容错（解决ValueError）
-    # 步骤1：清理时间列脏数据（空格、特殊字符）
-    df_standard["time"] = df_standard["time"].astype(str).str.strip()  # 去空格
-    df_standard["time"] = df_standard["time"].str.replace(r"[^\d:]", "", regex=True)  # 删特殊字符
-    # 步骤2：转换时间（兼容%H:%M、%H:%M:%S等格式，无效值填0）
-    time_series = pd.to_datetime(
-        df_standard["time"],
-        format="mixed",  # 自动识别常见时间格式（关键修复）
-        errors="coerce"  # 无法识别的时间→NaT
+def query_daily_cube(cube, selections):
+    """按侧边栏选择切片，返回全部日期的每日销售额"""
+    measures = slice_cube(cube, selections, keep=("date",))
+    # 空日期的取值是factorize给出的NaN：经DatetimeIndex转换为NaT（np.array无法直接把float转成datetime64）
+    days = pd.DatetimeIndex(cube["labels"]["date"]).to_numpy(dtype="datetime64[ns]")
+    return {"days": days, "daily_revenue": measures["revenue"]}
+
+
+# 3.2 位图索引（立方体无法覆盖的筛选，用位运算代替isin）
+def build_bitmap_index(df, columns=FILTER_DIMENSIONS):
+    """为每个筛选列的每个取值预先计算一个位图（np.packbits压缩，每行1比特）"""
+    bitmaps = {}
+    for column in columns:
+        codes, uniques = pd.factorize(df[column], use_na_sentinel=False)
+        bitmaps[column] = {value: np.packbits(codes == i) for i, value in enumerate(uniques)}
+    return {"n_rows": len(df), "bitmaps": bitmaps}
+
+
+def select_rows(bitmap_index, selections, rows=None):
+    """
+    组合位图得到行掩码：同一列内的取值取OR，不同列之间取AND
+    全选的列直接跳过；全程在压缩位图上运算，最后只解包一次
+    rows：可选的连续行区间（如日期区间），只计算该区间对应的字节，返回该区间内的掩码
+    """
+    start, stop = (0, bitmap_index["n_rows"]) if rows is None else (rows.start, rows.stop)
+    byte_lo, byte_hi = start // 8, (stop + 7) // 8
+    combined = None
+    for column, values in selections.items():
+        column_bitmaps = bitmap_index["bitmaps"][column]
+        chosen = [column_bitmaps[v] for v in set(values) if v in column_bitmaps]
+        if len(chosen) == len(column_bitmaps):
+            continue  # 该列全选，不影响结果
+        column_bits = np.zeros(byte_hi - byte_lo, dtype=np.uint8)
+        for bits in chosen:
+            np.bitwise_or(column_bits, bits[byte_lo:byte_hi], out=column_bits)
+        if combined is None:
+            combined = column_bits
+        else:
+            np.bitwise_and(combined, column_bits, out=combined)
+
+    if combined is None:
+        return np.ones(stop - start, dtype=bool)
+    offset = start - byte_lo * 8
+    return np.unpackbits(combined, count=offset + stop - start)[offset:].view(bool)
+
+
+@st.cache_resource(show_spinner="正在构建筛选索引...", max_entries=2)
+def load_bitmap_index(version):
+    """每个数据版本只构建一次位图索引，所有会话共享（只读）"""
+    return build_bitmap_index(_load_excel_data(version))
+
+
+# 3.3 单次汇总内核（立方体无法覆盖时，逐行汇总被选中的行）
+def build_kernel_inputs(df):
+    """每个数据版本只做一次：把 小时×产品类型 预编码为一个整数单元格编号，并准备好度量列"""
+    hour_codes, hours = pd.factorize(df["hour"], sort=True, use_na_sentinel=False)
+    category_codes, categories = pd.factorize(df["category"], sort=True, use_na_sentinel=False)
+    n_cells = len(hours) * len(categories)
+    cell_dtype = np.int16 if n_cells < np.iinfo(np.int16).max else np.int32
+    # 日期编码：数据已按日期排序，编码随行号单调不减（空日期排在最后）
+    day_codes, days = pd.factorize(df["date"], sort=True, use_na_sentinel=False)
+    inputs = {
+        "hours": list(hours),
+        "categories": list(categories),
+        "cells": (hour_codes * len(categories) + category_codes).astype(cell_dtype),
+        "days": day_codes.astype(np.int32),
+        "day_labels": np.asarray(days, dtype="datetime64[ns]"),
+    }
+    for column in ("revenue", "rating"):
+        values = df[column].to_numpy()
+        valid = ~np.isnan(values)
+        if valid.all():
+            inputs[column], inputs[f"{column}_valid"] = values, None
+        else:
+            # 空值按0参与求和，另外记录非空行，保证均值与pandas的mean一致
+            inputs[column], inputs[f"{column}_valid"] = np.where(valid, values, 0).astype(values.dtype), valid
+    return inputs
+
+
+@st.cache_resource(show_spinner="正在准备汇总编码...", max_entries=2)
+def load_kernel_inputs(version):
+    """汇总内核的输入按数据版本缓存，所有会话共享（只读）"""
+    return build_kernel_inputs(_load_excel_data(version))
+
+
+def aggregate_sales(inputs, mask=None, rows=None):
+    """
+    单次向量化汇总：以单元格编号为下标、度量为权重调用np.bincount，一次得到
+    小时×产品类型 的订单数、销售额、评分分布；3个KPI和2个图表都由它派生（summarize_aggregate）
+    rows：连续行区间（日期筛选）；mask：区间内被选中的行
+    """
+    # 被选中的行先转成下标，每列只做一次take（比逐列布尔索引快）
+    positions = None if mask is None else np.flatnonzero(mask)
+    if positions is not None and rows is not None:
+        positions += rows.start
+
+    def pick(values):
+        if values is None:
+            return None
+        if positions is not None:
+            return values.take(positions)
+        return values if rows is None else values[rows]
+
+    shape = (len(inputs["hours"]), len(inputs["categories"]))
+    size = shape[0] * shape[1]
+    cells = pick(inputs["cells"]).astype(np.intp)
+    orders = np.bincount(cells, minlength=size).reshape(shape)
+    agg = {"hours": inputs["hours"], "categories": inputs["categories"], "orders": orders}
+    for column in ("revenue", "rating"):
+        agg[column] = np.bincount(cells, weights=pick(inputs[column]), minlength=size).astype(float).reshape(shape)
+        valid = pick(inputs[f"{column}_valid"])
+        agg[f"{column}_n"] = orders if valid is None else np.bincount(cells[valid], minlength=size).reshape(shape)
+    agg["days"], agg["daily_revenue"] = daily_revenue(inputs, pick(inputs["days"]), pick(inputs["revenue"]), rows)
+    return agg
+
+
+def daily_revenue(inputs, days, revenue, rows=None):
+    """按日期编码汇总被选中行的销售额；rows为日期行区间时只保留区间内的日期"""
+    labels = inputs["day_labels"]
+    lo, hi = 0, len(labels)
+    if rows is not None:
+        codes = inputs["days"]
+        lo, hi = (int(codes[rows.start]), int(codes[rows.stop - 1]) + 1) if rows.stop > rows.start else (0, 0)
+    totals = np.bincount(days, weights=revenue, minlength=len(labels)).astype(float)
+    return labels[lo:hi], totals[lo:hi]
+
+
+# 3.4 跨会话结果缓存（热门筛选组合只计算一次）
+RESULT_CACHE_SIZE = 256  # 最多缓存的筛选组合个数，超出时淘汰最久未使用的
+
+
+@st.cache_resource
+def _result_cache():
+    """进程级LRU缓存（所有会话共享）：(数据版本, 规范化的筛选条件) → KPI与图表数据"""
+    return LRUCache(maxsize=RESULT_CACHE_SIZE), threading.Lock()
+
+
+def selection_key(selections, rows=None):
+    """规范化筛选条件：每个维度的取值去重排序（与勾选顺序无关），日期区间用行区间表示"""
+    normalized = tuple(
+        (dim, tuple(sorted(set(selections[dim]), key=str))) for dim in FILTER_DIMENSIONS
     )
-    # 步骤3：提取小时，NaT填充为0（避免后续图表报错）
-    df_standard["hour"] = time_series.dt.hour.fillna(0).astype(int)
+    return normalized, None if rows is None else (rows.start, rows.stop)
 
-    # 日期列转换（确保筛选器正常）
-    df_standard["date"] = pd.to_datetime(df_standard["date"], errors="coerce")
 
-    st.success(f"✅ 数据加载成功！共{len(df_standard)}条销售记录")
-    return df_standard
+def compute_summary(df, version, selections, rows=None, timings=None):
+    """按筛选条件计算KPI与图表数据：全部日期时用立方体（含每日立方体），按日期筛选或立方体过大时用位图"""
+    cube = load_sales_cube(version)
+    daily_cube = load_daily_cube(version) if cube is not None else None
+    if daily_cube is not None and rows is None:
+        # 立方体切片求和：耗时只与各维度的取值个数有关，与数据行数无关
+        with timed(timings, "筛选-立方体切片"):
+            agg = {**query_sales_cube(cube, selections), **query_daily_cube(daily_cube, selections)}
+    else:
+        # 按日期筛选或立方体过大时：位图组合出（日期区间内的）行掩码，再按 小时×产品类型 汇总被选中的行
+        with timed(timings, "筛选-位图组合"):
+            mask = select_rows(load_bitmap_index(version), selections, rows)
+        with timed(timings, "汇总-内核"):
+            agg = aggregate_sales(load_kernel_inputs(version), mask, rows)
+    with timed(timings, "汇总-KPI与图表数据"):
+        return summarize_aggregate(agg)
+
+
+def cached_summary(version, selections, rows=None):
+    """只查跨会话结果缓存，未命中返回None"""
+    cache, lock = _result_cache()
+    with lock:
+        return cache.get((version, selection_key(selections, rows)))
+
+
+def get_summary(df, version, selections, rows=None, timings=None):
+    """先查跨会话结果缓存，未命中才计算；缓存的结果所有会话共享，只读不改"""
+    with timed(timings, "结果缓存查询"):
+        summary = cached_summary(version, selections, rows)
+    if summary is None:
+        summary = compute_summary(df, version, selections, rows, timings)
+        cache, lock = _result_cache()
+        with lock:
+            cache[(version, selection_key(selections, rows))] = summary
+    return summary
+
+
+# 3.5 耗时统计（每次重新运行记录各阶段耗时）
+TIMING_LOG_PATH = os.environ.get("A11_TIMING_LOG", os.path.join(SNAPSHOT_DIR, "timings.jsonl"))  # 设为空字符串则不写日志
+
+
+@contextmanager
+def timed(timings, stage):
+    """统计代码块耗时（毫秒），追加到timings列表；timings为None时不记录"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings.append((stage, (time.perf_counter() - start) * 1000))
+
+
+def show_timings(timings):
+    """侧边栏折叠显示本次运行的耗时明细"""
+    with st.sidebar.expander("⏱️ 耗时明细", expanded=False):
+        breakdown = pd.DataFrame(timings, columns=["阶段", "耗时(ms)"])
+        st.dataframe(breakdown.round(2), hide_index=True, use_container_width=True)
+        st.caption(f"合计：{breakdown['耗时(ms)'].sum():.1f} ms")
+
+
+def log_timings(timings, **context):
+    """把本次运行的耗时追加到本地JSONL日志（每次运行一行），写入失败不影响页面"""
+    if not TIMING_LOG_PATH:
+        return
+    record = {"ts": datetime.now().isoformat(timespec="seconds"), **context, "stages": dict(timings)}
+    try:
+        os.makedirs(os.path.dirname(TIMING_LOG_PATH) or ".", exist_ok=True)
+        with open(TIMING_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except OSError:
+        pass
+
+
+# 3.6 导出筛选后的明细（按筛选掩码分块写出，不生成完整的筛选副本）
+EXPORT_CHUNK_ROWS = STREAM_CHUNK_ROWS  # 每次取出并写入的行数
+EXPORT_FORMATS = {  # 格式 → (扩展名, MIME类型)
+    "CSV": ("csv", "text/csv"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+EXPORT_COLUMNS = {v: k for k, v in COLUMN_MAPPING.items()}  # 导出时还原为Excel的中文列名
+
+
+def selected_positions(bitmap_index, selections, rows=None):
+    """筛选条件（及日期行区间）对应的行号数组"""
+    positions = np.flatnonzero(select_rows(bitmap_index, selections, rows))
+    if rows is not None:
+        positions += rows.start
+    return positions
+
+
+def iter_export_chunks(df, positions, chunk_rows=EXPORT_CHUNK_ROWS):
+    """按行号分块取出选中的行（列名还原为中文），内存中同时只有一块"""
+    for start in range(0, len(positions), chunk_rows):
+        yield df.take(positions[start:start + chunk_rows]).rename(columns=EXPORT_COLUMNS)
+
+
+def write_export(df, positions, out, fmt, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    把选中的行逐块写入二进制文件对象out：CSV逐块追加（带BOM，Excel可直接打开），
+    Parquet每块写一个row group；没有选中任何行时只写表头/表结构
+    """
+    header = df.iloc[:0].rename(columns=EXPORT_COLUMNS)
+    if fmt == "csv":
+        out.write(header.to_csv(index=False).encode("utf-8-sig"))
+        for chunk in iter_export_chunks(df, positions, chunk_rows):
+            out.write(chunk.to_csv(index=False, header=False).encode("utf-8"))
+    elif fmt == "parquet":
+        # 表结构按整列推断（空表推断不出文本列的类型），只读取不复制
+        schema = pa.Schema.from_pandas(df.rename(columns=EXPORT_COLUMNS, copy=False), preserve_index=False)
+        with pq.ParquetWriter(out, schema) as writer:
+            for chunk in iter_export_chunks(df, positions, chunk_rows):
+                writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+    else:
+        raise ValueError(f"不支持的导出格式：{fmt}")
+
+
+def export_to_bytes(write):
+    """
+    先逐块写入磁盘临时文件，再一次读出为bytes交给Streamlit（Streamlit会把整个文件读入内存，
+    且不接受TemporaryFile返回的BufferedRandom）；与BytesIO相比，写入过程中不会出现扩容产生的第二份副本
+    """
+    with tempfile.TemporaryFile(prefix="a11_export_") as out:  # 关闭后自动删除
+        write(out)
+        out.seek(0)
+        return out.read()
+
+
+def export_filtered_rows(df, version, selections, rows, fmt):
+    """供下载按钮在点击时调用：逐块写出当前筛选条件下的明细，返回文件内容（bytes），不生成完整的筛选副本"""
+    positions = selected_positions(load_bitmap_index(version), selections, rows)
+    return export_to_bytes(lambda out: write_export(df, positions, out, fmt))
+
+
+def show_export(build_file):
+    """
+    侧边栏：选择格式并下载当前筛选条件下的明细（点击时才生成文件，不触发重新运行）
+    build_file：fmt → 文件内容（bytes）
+    """
+    with st.sidebar.expander("⬇️ 导出明细", expanded=False):
+        label = st.radio("导出格式：", list(EXPORT_FORMATS), horizontal=True)
+        fmt, mime = EXPORT_FORMATS[label]
+        st.download_button(
+            "下载筛选后的明细",
+            data=lambda: build_file(fmt),
+            file_name=f"sales_filtered.{fmt}",
+            mime=mime,
+            on_click="ignore",
+        )
+
+
+# 3.7 渐进式渲染（大数据集先用分层样本给出近似结果，精确结果算完后替换）
+PROGRESSIVE_MIN_ROWS = int(os.environ.get("A11_PROGRESSIVE_MIN_ROWS", 1_000_000))  # 数据行数达到该值才先显示近似结果
+SAMPLE_ROWS = 20_000  # 样本总行数，与数据规模无关
+SAMPLE_STRATA = ["city", "category"]  # 分层维度
+SAMPLE_MIN_PER_STRATUM = 30  # 每层至少抽取的行数（小层整层入样）
+CONFIDENCE_Z = 1.96  # 95%置信区间
+
+
+def build_stratified_sample(df, n_target=SAMPLE_ROWS, strata=SAMPLE_STRATA, seed=0):
+    """
+    按 城市×产品类型 分层的简单随机抽样：每层按行数比例分配样本量（至少SAMPLE_MIN_PER_STRATUM行）
+    样本按行号排序，日期区间在样本上仍对应连续的一段；同时为样本准备好位图索引和汇总编码
+    """
+    codes = [pd.factorize(df[column], use_na_sentinel=False)[0] for column in strata]
+    shape = tuple(int(c.max()) + 1 if len(c) else 1 for c in codes)
+    stratum = np.ravel_multi_index(codes, shape) if len(df) else np.zeros(0, dtype=np.intp)
+    sizes = np.bincount(stratum, minlength=int(np.prod(shape)))
+    alloc = np.minimum(sizes, np.maximum(np.ceil(sizes * n_target / max(len(df), 1)), SAMPLE_MIN_PER_STRATUM)).astype(np.intp)
+
+    rng = np.random.default_rng(seed)
+    order = np.argsort(stratum, kind="stable")
+    starts = np.cumsum(sizes) - sizes
+    positions = np.sort(np.concatenate([np.zeros(0, dtype=np.intp)] + [
+        rng.choice(order[starts[s]:starts[s] + sizes[s]], alloc[s], replace=False)
+        for s in np.flatnonzero(alloc)
+    ]))
+    df_sample = df.take(positions)
+    return {
+        "positions": positions,
+        "stratum": stratum[positions],
+        "sizes": sizes,
+        "alloc": alloc,
+        "bitmap_index": build_bitmap_index(df_sample),
+        "inputs": build_kernel_inputs(df_sample),
+    }
+
+
+@st.cache_resource(show_spinner="正在抽取分层样本...", max_entries=2)
+def load_sales_sample(version):
+    """每个数据版本只抽样一次，所有会话共享（只读）"""
+    return build_stratified_sample(_load_excel_data(version))
+
+
+def _stratified_variance(stratum, groups, values, n_groups, sizes, alloc):
+    """
+    分层简单随机抽样下，各分组总量估计值的方差：sum_s N_s^2 (1 - n_s/N_s) S_s^2 / n_s
+    stratum/groups/values只需包含被选中的样本行，未选中的样本行取值为0，不影响各层的和与平方和
+    """
+    n_strata = len(sizes)
+    key = stratum * n_groups + groups
+    sum_y = np.bincount(key, weights=values, minlength=n_strata * n_groups).reshape(n_strata, n_groups)
+    sum_y2 = np.bincount(key, weights=values ** 2, minlength=n_strata * n_groups).reshape(n_strata, n_groups)
+    n = alloc.astype(float)[:, None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        s2 = np.where(n > 1, (sum_y2 - sum_y ** 2 / n) / (n - 1), 0.0)
+        factor = np.where(alloc > 0, sizes.astype(float) ** 2 * (1 - alloc / np.maximum(sizes, 1)) / alloc, 0.0)
+    return (factor[:, None] * np.maximum(s2, 0)).sum(axis=0)
+
+
+def estimate_summary(sample, selections, rows=None):
+    """
+    用分层样本估计KPI与图表数据（加权：每个样本行代表所在层的 N_s/n_s 行），
+    结果标记approximate，并附上总销售额与各柱体的95%置信区间半宽
+    rows：完整数据上的日期行区间，换算为样本上的连续区间
+    """
+    positions = sample["positions"]
+    if rows is not None:
+        rows = slice(*np.searchsorted(positions, [rows.start, rows.stop]).tolist())
+    selected = np.flatnonzero(select_rows(sample["bitmap_index"], selections, rows))
+    if rows is not None:
+        selected += rows.start
+
+    inputs = sample["inputs"]
+    n_categories = len(inputs["categories"])
+    shape = (len(inputs["hours"]), n_categories)
+    size = shape[0] * shape[1]
+    stratum = sample["stratum"][selected]
+    weight = (sample["sizes"] / np.maximum(sample["alloc"], 1))[stratum]
+    cells = inputs["cells"][selected].astype(np.intp)
+
+    agg = {"hours": inputs["hours"], "categories": inputs["categories"]}
+    agg["orders"] = np.bincount(cells, weights=weight, minlength=size).reshape(shape)
+    for column in ("revenue", "rating"):
+        values = inputs[column][selected].astype(float)
+        valid = inputs[f"{column}_valid"]
+        valid_weight = weight if valid is None else weight * valid[selected]
+        agg[column] = np.bincount(cells, weights=weight * values, minlength=size).reshape(shape)
+        agg[f"{column}_n"] = np.bincount(cells, weights=valid_weight, minlength=size).reshape(shape)
+    agg["days"], agg["daily_revenue"] = daily_revenue(
+        inputs, inputs["days"][selected], weight * inputs["revenue"][selected], rows)
+    summary = summarize_aggregate(agg)
+    summary["orders"] = int(round(agg["orders"].sum()))
+
+    # 置信区间：总销售额、各小时、各产品类型的销售额
+    revenue = inputs["revenue"][selected].astype(float)
+
+    def variance(groups, n_groups):
+        return _stratified_variance(stratum, groups, revenue, n_groups, sample["sizes"], sample["alloc"])
+
+    summary["total_revenue_error"] = CONFIDENCE_Z * float(np.sqrt(variance(np.zeros_like(cells), 1)[0]))
+    hour_error = CONFIDENCE_Z * np.sqrt(variance(cells // n_categories, shape[0]))
+    category_error = CONFIDENCE_Z * np.sqrt(variance(cells % n_categories, n_categories))
+    summary["hour_sales"]["error"] = summary["hour_sales"]["hour"].map(dict(zip(inputs["hours"], hour_error))).to_numpy()
+    summary["category_sales"]["error"] = summary["category_sales"]["category"].map(
+        dict(zip(inputs["categories"], category_error))).to_numpy()
+    summary["approximate"] = True
+    return summary
+
+
+def use_progressive(df, version, rows=None):
+    """数据足够大、且本次无法直接查立方体时，才先显示样本估计（立方体查询与数据行数无关，无需近似）"""
+    if len(df) < PROGRESSIVE_MIN_ROWS:
+        return False
+    return rows is not None or load_sales_cube(version) is None or load_daily_cube(version) is None
+
+
+def approx_bar_chart(data, x, sort=None):
+    """近似结果的柱状图：柱体为估计值，误差线为95%置信区间"""
+    data = data.assign(
+        lower=(data["revenue"] - data["error"]).clip(lower=0),
+        upper=data["revenue"] + data["error"],
+    )
+    x_axis = alt.X(f"{x}:O", sort=sort)
+    base = alt.Chart(data)
+    bars = base.mark_bar(color="#007bff", opacity=0.6).encode(x=x_axis, y=alt.Y("revenue:Q", title="revenue"))
+    errors = base.mark_errorbar(color="#2c3e50").encode(x=x_axis, y=alt.Y("lower:Q", title="revenue"), y2="upper:Q")
+    return bars + errors
+
+
+# 3.8 销售额趋势（按日/按周，服务端降采样到固定点数）
+TREND_MAX_POINTS = 500  # 趋势图最多发送的点数，与数据跨越的年数无关
+TREND_GRANULARITY = ["按日", "按周"]
+
+
+def lttb_downsample(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets降采样：保留首尾点，中间每个桶保留与前一个保留点、
+    下一个桶均值构成三角形面积最大的点（保留峰谷形状）；返回保留点的下标
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.intp)  # 中间 n_out-2 个桶的边界
+    keep = np.empty(n_out, dtype=np.intp)
+    keep[0], keep[-1] = 0, n - 1
+    prev = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_lo, next_hi = hi, edges[i + 2] if i + 2 < len(edges) else n
+        next_x, next_y = x[next_lo:next_hi].mean(), y[next_lo:next_hi].mean()
+        area = np.abs((x[prev] - next_x) * (y[lo:hi] - y[prev]) - (x[prev] - x[lo:hi]) * (next_y - y[prev]))
+        prev = lo + int(np.argmax(area))
+        keep[i + 1] = prev
+    return keep
+
+
+def trend_series(daily_sales, granularity="按日", max_points=TREND_MAX_POINTS):
+    """每日销售额 → 按日/按周（周一开始）的趋势，点数超过max_points时用LTTB降采样"""
+    trend = daily_sales
+    if granularity == "按周":
+        week = trend["date"] - pd.to_timedelta(trend["date"].dt.dayofweek, unit="D")
+        trend = trend.groupby(week.rename("date"))["revenue"].sum().reset_index()
+    x = trend["date"].to_numpy().astype("datetime64[D]").astype(float)
+    keep = lttb_downsample(x, trend["revenue"].to_numpy(dtype=float), max_points)
+    return trend.iloc[keep].reset_index(drop=True)
+
+
+# 3.9 图表交叉筛选（点击小时/产品类型柱体，筛选另一个图表和KPI）
+CROSS_FILTER_STATE = {"hour": "cross_filter_hour", "category": "cross_filter_category"}  # 点选状态的session_state键
+CROSS_FILTER_CHARTS = {"hour": "hour_chart", "category": "category_chart"}  # 图表组件的key
+
+
+def get_cross_filter():
+    """当前会话的图表点选：{"hour": [...], "category": [...]}，空列表表示未点选"""
+    return {field: st.session_state.get(state_key, []) for field, state_key in CROSS_FILTER_STATE.items()}
+
+
+def store_chart_selection(field):
+    """
+    图表点选回调：点击柱体只保留该柱体，再次点击同一柱体或点击空白处取消
+    点选状态另存一份：另一个图表的点选改变本图表的数据后，图表组件会重建并丢失自身的选择
+    """
+    points = st.session_state[CROSS_FILTER_CHARTS[field]]["selection"].get(f"{field}_select")
+    clicked = [p[field] for p in points if field in p] if isinstance(points, list) else []
+    state_key = CROSS_FILTER_STATE[field]
+    st.session_state[state_key] = [] if clicked == st.session_state.get(state_key, []) else clicked
+
+
+def clear_cross_filter():
+    """清除两个图表的点选"""
+    for state_key in CROSS_FILTER_STATE.values():
+        st.session_state[state_key] = []
+
+
+def _restrict_grid(grid, hours=None, categories=None):
+    """把网格中未选中的小时行、产品类型列置0（None或空列表表示不限）"""
+    keep = np.ones(grid["orders"].shape, dtype=bool)
+    if hours:
+        keep &= pd.Index(grid["hours"]).isin(hours)[:, None]
+    if categories:
+        keep &= pd.Index(grid["categories"]).isin(categories)[None, :]
+    return {**grid, **{name: np.where(keep, grid[name], 0) for name in GRID_MEASURES}}
+
+
+def cross_filter_summary(summary, cross):
+    """
+    在 小时×产品类型 网格上应用图表点选（只用已汇总的结果，不重新扫描数据）：
+    KPI同时按两个图表的点选筛选；每个图表只按另一个图表的点选筛选，自身保留全部柱体
+    返回新的结果，不修改共享的summary
+    """
+    hours, categories = cross.get("hour"), cross.get("category")
+    if not hours and not categories:
+        return summary
+    grid = summary["grid"]
+    view = summarize_aggregate(_restrict_grid(grid, hours, categories))
+    view["hour_sales"] = summarize_aggregate(_restrict_grid(grid, categories=categories))["hour_sales"]
+    view["category_sales"] = summarize_aggregate(_restrict_grid(grid, hours=hours))["category_sales"]
+    if "daily_sales" in summary:
+        view["daily_sales"] = summary["daily_sales"]  # 趋势图不受图表点选影响
+    return view
+
+
+def selectable_bar_chart(data, x, selected, sort=None):
+    """可点选的柱状图：点击柱体触发交叉筛选，按保存的点选状态高亮选中的柱体"""
+    selection = alt.selection_point(name=f"{x}_select", fields=[x])
+    data = data.assign(selected=data[x].isin(selected) if selected else True)
+    return alt.Chart(data).mark_bar(color="#007bff").encode(
+        x=alt.X(f"{x}:O", sort=sort),
+        y=alt.Y("revenue:Q"),
+        opacity=alt.when(alt.datum.selected).then(alt.value(1.0)).otherwise(alt.value(0.35)),
+        tooltip=[alt.Tooltip(f"{x}:O"), alt.Tooltip("revenue:Q", format=",.2f")],
+    ).add_params(selection)
+
+
+def show_cross_filter(view, cross):
+    """有图表点选时，提示当前的点选条件并提供清除按钮"""
+    parts = []
+    if cross.get("hour"):
+        parts.append("小时 " + "、".join(str(h) for h in cross["hour"]))
+    if cross.get("category"):
+        parts.append("产品类型 " + "、".join(str(c) for c in cross["category"]))
+    if not parts:
+        return
+    col1, col2 = st.columns([4, 1])
+    col1.caption(f"🔗 图表筛选：{'；'.join(parts)}（{view['orders']} 条记录），再次点击柱体可取消")
+    col2.button("清除图表筛选", on_click=clear_cross_filter)
+
+
+# 3.10 前缀和索引（任意日期区间的汇总 = 两次查找相减，用于环比）
+PREFIX_MEASURES = ("orders", "revenue", "rating", "rating_n")
+
+
+def build_prefix_index(df, dimensions=FILTER_DIMENSIONS):
+    """
+    为每个筛选单元格（城市×顾客类型×性别）按连续的自然日计算累计和：
+    P[..., d] = 第0天到第d-1天的合计（P[..., 0] = 0），任意 [d0, d1] 的合计为 P[..., d1 + 1] - P[..., d0]
+    空日期不参与；没有有效日期时返回None
+    """
+    dates = df["date"].to_numpy()
+    valid = ~np.isnat(dates)
+    if not valid.any():
+        return None
+    days = dates[valid].astype("datetime64[D]")
+    first = days.min()
+    n_days = int((days.max() - first).astype(int)) + 1
+    day = (days - first).astype(np.intp)
+
+    labels, codes = {}, []
+    for dim in dimensions:
+        dim_codes, uniques = pd.factorize(df[dim], sort=True, use_na_sentinel=False)
+        labels[dim] = list(uniques)
+        codes.append(dim_codes[valid])
+    shape = tuple(len(labels[dim]) for dim in dimensions)
+    flat = np.ravel_multi_index(codes, shape) * n_days + day
+    size = int(np.prod(shape)) * n_days
+
+    revenue = df["revenue"].to_numpy(dtype=float)[valid]
+    rating = df["rating"].to_numpy(dtype=float)[valid]
+    daily = daily_cell_totals(flat, revenue, rating, size)
+    return prefix_index_from_daily(labels, first, n_days, daily)
+
+
+def daily_cell_totals(flat, revenue, rating, size):
+    """按 单元格×自然日 的扁平编号汇总订单数、销售额、评分之和与评分非空数（空值不计入）"""
+    rated = ~np.isnan(rating)
+    return {
+        "orders": np.bincount(flat, minlength=size),
+        "revenue": np.bincount(flat, weights=np.nan_to_num(revenue), minlength=size),
+        "rating": np.bincount(flat[rated], weights=rating[rated], minlength=size).astype(float),
+        "rating_n": np.bincount(flat[rated], minlength=size),
+    }
+
+
+def prefix_index_from_daily(labels, first_day, n_days, daily):
+    """由 单元格×自然日 的合计（扁平数组）沿日期方向累加，得到前缀和索引"""
+    dimensions = list(labels)
+    shape = tuple(len(labels[dim]) for dim in dimensions)
+    measures = {}
+    for name, values in daily.items():
+        prefix = np.zeros(shape + (n_days + 1,), dtype=np.int64 if name in ("orders", "rating_n") else float)
+        np.cumsum(values.reshape(shape + (n_days,)), axis=-1, out=prefix[..., 1:])
+        measures[name] = prefix
+    return {
+        "dimensions": dimensions,
+        "labels": labels,
+        "index": {dim: {value: i for i, value in enumerate(labels[dim])} for dim in dimensions},
+        "first_day": first_day,
+        "n_days": n_days,
+        "measures": measures,
+    }
+
+
+def merge_prefix_index(base, delta):
+    """
+    把增量行的前缀和索引加到基础索引上，返回新索引，不修改base：维度取值、日期范围都取并集，
+    两个索引各自沿日期方向对齐到新范围（范围之前记0，之后保持最后的累计值）再相加，
+    累加只在增量行自己的日期范围内做过一次，旧数据不重新汇总
+    """
+    if delta is None:
+        return base
+    dimensions = base["dimensions"]
+    labels, grid_of = _merge_labels(base, delta)
+    shape = tuple(len(labels[dim]) for dim in dimensions)
+    first_day = min(base["first_day"], delta["first_day"])
+    end_day = max(base["first_day"] + base["n_days"], delta["first_day"] + delta["n_days"])
+    n_days = int((end_day - first_day).astype(int))
+
+    aligned = []
+    for source in (base, delta):
+        offset = int((source["first_day"] - first_day).astype(int))
+        days = np.clip(np.arange(n_days + 1) - offset, 0, source["n_days"])
+        aligned.append((grid_of(source), source, days))
+    measures = {}
+    for name, values in base["measures"].items():
+        merged = np.zeros(shape + (n_days + 1,), dtype=values.dtype)
+        for grid, source, days in aligned:
+            merged[grid] += source["measures"][name][..., days]
+        measures[name] = merged
+    return {
+        "dimensions": list(dimensions),
+        "labels": labels,
+        "index": {dim: {value: i for i, value in enumerate(labels[dim])} for dim in dimensions},
+        "first_day": first_day,
+        "n_days": n_days,
+        "measures": measures,
+    }
+
+
+@st.cache_resource(show_spinner="正在构建前缀和索引...", max_entries=2)
+def load_prefix_index(version):
+    """
+    每个数据版本只构建一次前缀和索引（所有会话共享，只读），单元格过多时返回None
+    追加新行时只为新增行构建索引，再合并进上一版本
+    """
+    df = _load_excel_data(version)
+    if df.empty:
+        return None
+    dates = df["date"].dropna()
+    if dates.empty:
+        return None
+    n_days = (dates.iloc[-1] - dates.iloc[0]).days + 1  # 数据已按日期排序
+    n_cells = np.prod([df[dim].nunique(dropna=False) for dim in FILTER_DIMENSIONS]) * (n_days + 1)
+    if n_cells > CUBE_MAX_CELLS:
+        return None
+    return build_incrementally("prefix", version, df, build_prefix_index, merge_prefix_index)
+
+
+def period_totals(prefix_index, selections, start, end):
+    """
+    [start, end] 两天之间（含）所选单元格的订单数、销售额、平均评分：
+    每个单元格两次查找相减，耗时只与单元格个数有关，与天数和行数无关
+    """
+    first, n_days = prefix_index["first_day"], prefix_index["n_days"]
+    lo = int(np.clip((np.datetime64(start, "D") - first).astype(int), 0, n_days))
+    hi = int(np.clip((np.datetime64(end, "D") - first).astype(int) + 1, lo, n_days))
+    slicers = []
+    for dim in prefix_index["dimensions"]:
+        lookup = prefix_index["index"][dim]
+        values = selections[dim] if dim in selections else prefix_index["labels"][dim]
+        slicers.append([lookup[v] for v in values if v in lookup])
+    grid = np.ix_(*slicers, [lo, hi])
+    totals = {name: float(np.diff(values[grid], axis=-1).sum()) for name, values in prefix_index["measures"].items()}
+    return {
+        "orders": int(totals["orders"]),
+        "revenue": totals["revenue"],
+        "avg_rating": totals["rating"] / totals["rating_n"] if totals["rating_n"] else float("nan"),
+    }
+
+
+def period_bounds(anchor, period):
+    """
+    截至anchor（含）的本期与上期，上期截至相同的相对日期（周一为一周的开始）：
+    返回 ((本期起, 本期止), (上期起, 上期止))
+    """
+    anchor = pd.Timestamp(anchor).normalize()
+    if period == "week":
+        start = anchor - pd.Timedelta(days=anchor.dayofweek)
+        return (start, anchor), (start - pd.Timedelta(days=7), anchor - pd.Timedelta(days=7))
+    start = anchor.replace(day=1)
+    prev_start = start - pd.DateOffset(months=1)
+    prev_end = min(prev_start + (anchor - start), start - pd.Timedelta(days=1))  # 上月没有对应日期时截至月末
+    return (start, anchor), (prev_start, prev_end)
+
+
+# 3.11 外存模式（数据大于内存时：数据留在磁盘上的分区Parquet数据集，每次筛选扫描一遍）
+PARQUET_DATASET = os.environ.get("A11_PARQUET_DATASET", "")  # 设置后进入外存模式
+HIVE_NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"  # 城市为空的行所在的目录名
+SCAN_BATCH_ROWS = 131_072  # 每批扫描的行数（也是写入时行组的大小），内存占用与之成正比
+SCAN_COLUMNS = ["hour", "category", "revenue", "rating", "date"]  # 汇总只读取这些列（列裁剪）
+META_COLUMNS = FILTER_DIMENSIONS + ["category", "hour", "date"]
+EXPORT_ORDER = ["订单号", *COLUMN_MAPPING.values(), "hour"]  # 导出时的列顺序（与内存模式一致）
+
+
+def write_parquet_dataset(source, dataset_dir):
+    """
+    把数据源（单个文件或多个分区文件）逐个文件转换为按城市分区的Parquet数据集（city=<城市>/<文件名>.parquet），
+    内存中每次只有一个源文件；分类列写为普通字符串（各文件的字典不一致），每个文件按日期排序，
+    行组的日期统计可用于跳过日期范围外的行组。重新转换同一个源文件时先删除它在各城市分区下的旧文件
+    （数据中已没有的城市不会残留旧行），再写入新文件；返回转换的文件数
+    """
+    files = resolve_data_files(source)
+    for path in files:
+        df_standard = sort_by_date(load_sales_file(path))
+        stem = os.path.splitext(os.path.basename(path))[0]
+        for old_file in glob.glob(os.path.join(glob.escape(dataset_dir), "city=*", glob.escape(f"{stem}.parquet"))):
+            os.remove(old_file)
+        for city, part in df_standard.groupby("city", observed=True, dropna=False, sort=True):
+            table = pa.Table.from_pandas(part.drop(columns="city"), preserve_index=False)
+            schema = pa.schema([
+                pa.field(f.name, f.type.value_type if pa.types.is_dictionary(f.type) else f.type) for f in table.schema
+            ])
+            segment = HIVE_NULL_PARTITION if pd.isna(city) else quote(str(city), safe="")
+            partition_dir = os.path.join(dataset_dir, f"city={segment}")
+            os.makedirs(partition_dir, exist_ok=True)
+            pq.write_table(
+                table.cast(schema).replace_schema_metadata(None),
+                os.path.join(partition_dir, f"{stem}.parquet"),
+                row_group_size=SCAN_BATCH_ROWS,
+            )
+    return len(files)
+
+
+def parquet_dataset_version(dataset_dir=PARQUET_DATASET):
+    """数据集的版本号：全部Parquet文件的标识（找不到文件时返回None）"""
+    files = sorted(glob.glob(os.path.join(dataset_dir, "**", "*.parquet"), recursive=True))
+    if not files:
+        return None
+    return json.dumps({"dataset": [_source_signature(path) for path in files]}, sort_keys=True)
+
+
+@st.cache_resource(max_entries=2)
+def open_sales_dataset(version):
+    """按版本打开数据集（只读取目录结构和文件元数据，不读取数据）"""
+    return ds.dataset(PARQUET_DATASET, format="parquet", partitioning="hive")
+
+
+def _label_codes(values, labels):
+    """按给定的取值列表（排序、空值在最后）编码，与factorize(sort=True, use_na_sentinel=False)一致"""
+    present = [v for v in labels if not pd.isna(v)]
+    codes = pd.Categorical(values, categories=present).codes.astype(np.intp)
+    codes[codes < 0] = len(present)  # 空值
+    return codes
+
+
+def scan_dataset_meta(dataset, batch_rows=SCAN_BATCH_ROWS):
+    """
+    每个数据版本扫描两遍（只读取维度列和度量列）：
+    第1遍得到各维度的取值、全部日期和总行数；第2遍按 筛选维度×自然日 累加，得到与内存模式相同的前缀和索引
+    """
+    values = {column: set() for column in META_COLUMNS}
+    n_rows = 0
+    for batch in dataset.to_batches(columns=META_COLUMNS, batch_size=batch_rows):
+        n_rows += batch.num_rows
+        for column in META_COLUMNS:
+            values[column].update(batch.column(column).unique().to_pylist())
+    labels = {
+        column: _sorted_labels([np.nan if v is None else v for v in values[column]])
+        for column in META_COLUMNS if column != "date"
+    }
+    days = np.array(sorted(v for v in values["date"] if v is not None), dtype="datetime64[ns]")
+    meta = {"n_rows": n_rows, "labels": labels, "days": days, "prefix_index": None}
+
+    filter_labels = {dim: labels[dim] for dim in FILTER_DIMENSIONS}
+    if not len(days):
+        return meta
+    first = days[0].astype("datetime64[D]")
+    n_days = int((days[-1].astype("datetime64[D]") - first).astype(int)) + 1
+    shape = tuple(len(filter_labels[dim]) for dim in FILTER_DIMENSIONS)
+    size = int(np.prod(shape)) * n_days
+    if size + int(np.prod(shape)) > CUBE_MAX_CELLS:
+        return meta
+    daily = None
+    columns = FILTER_DIMENSIONS + ["date", "revenue", "rating"]
+    for batch in dataset.to_batches(columns=columns, filter=ds.field("date").is_valid(), batch_size=batch_rows):
+        frame = batch.to_pandas()
+        codes = [_label_codes(frame[dim], filter_labels[dim]) for dim in FILTER_DIMENSIONS]
+        day = (frame["date"].to_numpy().astype("datetime64[D]") - first).astype(np.intp)
+        flat = np.ravel_multi_index(codes, shape) * n_days + day
+        totals = daily_cell_totals(
+            flat, frame["revenue"].to_numpy(dtype=float), frame["rating"].to_numpy(dtype=float), size)
+        daily = totals if daily is None else {name: daily[name] + totals[name] for name in daily}
+    if daily is not None:
+        meta["prefix_index"] = prefix_index_from_daily(filter_labels, first, n_days, daily)
+    return meta
+
+
+@st.cache_resource(show_spinner="正在扫描数据集...", max_entries=2)
+def load_dataset_meta(version):
+    """数据集的维度取值、日期和前缀和索引按版本缓存，所有会话共享（只读）"""
+    return scan_dataset_meta(open_sales_dataset(version))
+
+
+def scan_filter(meta, selections, date_range=None):
+    """
+    把侧边栏筛选转换为Arrow谓词，下推到扫描：城市条件跳过分区目录，日期条件借助行组统计跳过行组
+    某维度全选时不加条件（与位图筛选一致，空值行也保留）；没有任何条件时返回None
+    """
+    predicate = None
+    for dim, selected in selections.items():
+        present = {v for v in meta["labels"][dim] if not pd.isna(v)}
+        if present <= set(selected):
+            continue
+        chosen = [v for v in selected if v in present]
+        condition = ds.field(dim).isin(chosen) if chosen else ds.scalar(False)  # 未选任何取值：没有符合条件的行
+        predicate = condition if predicate is None else predicate & condition
+    if date_range is not None:
+        start = pd.Timestamp(date_range[0])
+        end = pd.Timestamp(date_range[1]) + pd.Timedelta(days=1)
+        condition = (ds.field("date") >= pa.scalar(start, pa.timestamp("ns"))) & (ds.field("date") < pa.scalar(end, pa.timestamp("ns")))
+        predicate = condition if predicate is None else predicate & condition
+    return predicate
+
+
+def scan_summary(dataset, meta, selections, date_range=None, batch_rows=SCAN_BATCH_ROWS):
+    """
+    扫描数据集得到KPI与图表数据：谓词下推 + 只读取汇总需要的列，每批按 小时×产品类型 和日期累加，
+    内存占用只与批大小有关；结果与内存模式的立方体/内核一致
+    """
+    hours, categories = meta["labels"]["hour"], meta["labels"]["category"]
+    days = meta["days"]
+    shape = (len(hours), len(categories))
+    size = shape[0] * shape[1]
+    totals = {name: np.zeros(size) for name in GRID_MEASURES}
+    daily = np.zeros(len(days))
+
+    predicate = scan_filter(meta, selections, date_range)
+    for batch in dataset.to_batches(columns=SCAN_COLUMNS, filter=predicate, batch_size=batch_rows):
+        frame = batch.to_pandas()
+        cells = _label_codes(frame["hour"], hours) * shape[1] + _label_codes(frame["category"], categories)
+        totals["orders"] += np.bincount(cells, minlength=size)
+        for column in ("revenue", "rating"):
+            values = frame[column].to_numpy(dtype=float)
+            valid = ~np.isnan(values)
+            totals[column] += np.bincount(cells[valid], weights=values[valid], minlength=size)
+            totals[f"{column}_n"] += np.bincount(cells[valid], minlength=size)
+        dates = frame["date"].to_numpy()
+        dated = ~np.isnat(dates)
+        day = np.searchsorted(days, dates[dated])
+        daily += np.bincount(day, weights=np.nan_to_num(frame["revenue"].to_numpy(dtype=float)[dated]), minlength=len(days))
+
+    agg = {"hours": hours, "categories": categories}
+    for name, values in totals.items():
+        values = values.reshape(shape)
+        agg[name] = values.astype(np.int64) if name in ("orders", "revenue_n", "rating_n") else values
+    lo, hi = 0, len(days)
+    if date_range is not None:
+        lo, hi = np.searchsorted(days, [np.datetime64(date_range[0], "ns"), np.datetime64(date_range[1], "ns") + np.timedelta64(1, "D")])
+    agg["days"], agg["daily_revenue"] = days[lo:hi], daily[lo:hi]
+    return summarize_aggregate(agg)
+
+
+def get_scan_summary(dataset, meta, version, selections, date_range=None, timings=None):
+    """外存模式的结果同样放入跨会话结果缓存（键中用日期范围代替行区间）"""
+    cache, lock = _result_cache()
+    key = (version, selection_key(selections), date_range)
+    with timed(timings, "结果缓存查询"):
+        with lock:
+            summary = cache.get(key)
+    if summary is None:
+        with timed(timings, "扫描-谓词下推汇总"):
+            summary = scan_summary(dataset, meta, selections, date_range)
+        with lock:
+            cache[key] = summary
+    return summary
+
+
+def write_scanned_export(batches, schema, out, fmt):
+    """把扫描得到的记录批次逐批写入out（列名还原为中文），格式与内存模式的导出一致"""
+    names = [EXPORT_COLUMNS.get(name, name) for name in schema.names]
+    if fmt == "csv":
+        out.write(pd.DataFrame(columns=names).to_csv(index=False).encode("utf-8-sig"))
+        for batch in batches:
+            out.write(batch.to_pandas().to_csv(index=False, header=False).encode("utf-8"))
+    elif fmt == "parquet":
+        renamed = pa.schema([field.with_name(name) for field, name in zip(schema, names)])
+        with pq.ParquetWriter(out, renamed) as writer:
+            for batch in batches:
+                writer.write_batch(pa.RecordBatch.from_arrays(batch.columns, schema=renamed))
+    else:
+        raise ValueError(f"不支持的导出格式：{fmt}")
+
+
+def export_scanned_rows(dataset, meta, selections, date_range, fmt):
+    """外存模式的导出：按筛选条件扫描数据集，逐批写入磁盘临时文件，返回文件内容（bytes）"""
+    columns = [c for c in EXPORT_ORDER if c in dataset.schema.names]
+    columns += [c for c in dataset.schema.names if c not in columns]
+    scanner = dataset.scanner(columns=columns, filter=scan_filter(meta, selections, date_range), batch_size=EXPORT_CHUNK_ROWS)
+    return export_to_bytes(lambda out: write_scanned_export(scanner.to_batches(), scanner.projected_schema, out, fmt))
 
 
 # 4. KPI指标生成（匹配效果图的3个核心指标）
-def generate_kpi(filtered_df):
-    """生成：总销售额、顾客平均评分、每单平均销售额"""
+def generate_kpi(summary):
+    """生成：总销售额、顾客平均评分、每单平均销售额（样本估计的结果带"近似值"标记）"""
     # 分3列展示KPI
     col1, col2, col3 = st.columns(3, gap="medium")
+    approximate = summary.get("approximate", False)
+    badge = '<span class="approx-badge">≈ 近似值</span>' if approximate else ""
 
     # 总销售额
     with col1:
         st.markdown('<div class="metric-card">', unsafe_allow_html=True)
-        st.markdown('<div class="metric-title">总销售额：</div>', unsafe_allow_html=True)
-        total_revenue = filtered_df["revenue"].sum()
-        st.markdown(f'<div class="metric-value">RMB ¥ {total_revenue:,.0f}</div>', unsafe_allow_html=True)
+        st.markdown(f'<div class="metric-title">总销售额：{badge}</div>', unsafe_allow_html=True)
+        total_revenue = summary["total_revenue"]
+        error = f'<span class="metric-error"> ± {summary["total_revenue_error"]:,.0f}</span>' if approximate else ""
+        st.markdown(f'<div class="metric-value">RMB ¥ {total_revenue:,.0f}{error}</div>', unsafe_allow_html=True)
         st.markdown('</div>', unsafe_allow_html=True)
 
     # 顾客平均评分
     with col2:
         st.markdown('<div class="metric-card">', unsafe_allow_html=True)
-        st.markdown('<div class="metric-title">顾客评分的平均值：</div>', unsafe_allow_html=True)
-        avg_rating = filtered_df["rating"].mean()
+        st.markdown(f'<div class="metric-title">顾客评分的平均值：{badge}</div>', unsafe_allow_html=True)
+        avg_rating = summary["avg_rating"]
         st.markdown(f'<div class="metric-value">{avg_rating:.1f} ⭐</div>', unsafe_allow_html=True)
         st.markdown('</div>', unsafe_allow_html=True)
 
     # 每单平均销售额
     with col3:
         st.markdown('<div class="metric-card">', unsafe_allow_html=True)
-        st.markdown('<div class="metric-title">每单的平均销售额：</div>', unsafe_allow_html=True)
-        avg_order = filtered_df["revenue"].mean()
+        st.markdown(f'<div class="metric-title">每单的平均销售额：{badge}</div>', unsafe_allow_html=True)
+        avg_order = summary["avg_order"]
         st.markdown(f'<div class="metric-value">RMB ¥ {avg_order:.2f}</div>', unsafe_allow_html=True)
         st.markdown('</div>', unsafe_allow_html=True)
 
 
+PERIODS = {"week": ("本周", "上周"), "month": ("本月", "上月")}
+
+
+def generate_period_kpis(prefix_index, selections, anchor):
+    """环比：截至anchor的本周/本月与上周/上月对比（销售额、订单数、平均评分），由前缀和索引直接得到"""
+    st.subheader(f"📅 环比（截至 {pd.Timestamp(anchor):%Y-%m-%d}）")
+    for period, (current_name, previous_name) in PERIODS.items():
+        (start, end), (prev_start, prev_end) = period_bounds(anchor, period)
+        current = period_totals(prefix_index, selections, start, end)
+        previous = period_totals(prefix_index, selections, prev_start, prev_end)
+        help_text = f"{start:%m-%d}~{end:%m-%d} 对比 {prev_start:%m-%d}~{prev_end:%m-%d}"
+
+        col1, col2, col3 = st.columns(3, gap="medium")
+        revenue_delta = (current["revenue"] / previous["revenue"] - 1) if previous["revenue"] else None
+        col1.metric(
+            f"{current_name}销售额",
+            f"RMB ¥ {current['revenue']:,.0f}",
+            delta=None if revenue_delta is None else f"{revenue_delta:+.1%} 较{previous_name}",
+            help=help_text,
+        )
+        col2.metric(
+            f"{current_name}订单数",
+            f"{current['orders']:,}",
+            delta=f"{current['orders'] - previous['orders']:+,} 较{previous_name}",
+            help=help_text,
+        )
+        rating_delta = current["avg_rating"] - previous["avg_rating"]
+        col3.metric(
+            f"{current_name}平均评分",
+            "-" if np.isnan(current["avg_rating"]) else f"{current['avg_rating']:.2f} ⭐",
+            delta=None if np.isnan(rating_delta) else f"{rating_delta:+.2f} 较{previous_name}",
+            help=help_text,
+        )
+
+
 # 5. 图表生成（复刻效果图的2个核心图表）
-def generate_charts(filtered_df):
-    """生成：按小时销售额、按产品类型销售额"""
+def generate_charts(summary, granularity="按日", cross=None):
+    """
+    生成：按小时销售额、按产品类型销售额、销售额趋势（样本估计的结果带误差线）
+    cross：图表点选状态；提供时两个柱状图可点击交叉筛选
+    """
     # 分2列展示图表
     col1, col2 = st.columns(2, gap="medium")
+    approximate = summary.get("approximate", False)
+    suffix = "（≈ 近似值）" if approximate else ""
 
     # 图表1：按小时划分的销售额
     with col1:
         st.markdown('<div class="chart-container">', unsafe_allow_html=True)
-        st.subheader("📊 按小时数划分的销售额")
-        # 按小时聚合销售额
-        hour_sales = filtered_df.groupby("hour")["revenue"].sum().reset_index()
-        # 绘制柱状图（匹配效果图风格）
-        st.bar_chart(
-            hour_sales,
-            x="hour",
-            y="revenue",
-            color="#007bff",  # 蓝色柱体
-            use_container_width=True
-        )
+        st.subheader(f"📊 按小时数划分的销售额{suffix}")
+        # 按小时聚合的销售额（由立方体切片得到）
+        hour_sales = summary["hour_sales"]
+        if approximate:
+            st.altair_chart(approx_bar_chart(hour_sales, "hour"), use_container_width=True)
+        elif cross is not None:
+            st.altair_chart(
+                selectable_bar_chart(hour_sales, "hour", cross["hour"]),
+                use_container_width=True,
+                key=CROSS_FILTER_CHARTS["hour"],
+                on_select=lambda: store_chart_selection("hour"),
+            )
+        else:
+            # 绘制柱状图（匹配效果图风格）
+            st.bar_chart(
+                hour_sales,
+                x="hour",
+                y="revenue",
+                color="#007bff",  # 蓝色柱体
+                use_container_width=True
+            )
         st.markdown('</div>', unsafe_allow_html=True)
 
     # 图表2：按产品类型划分的销售额
     with col2:
         st.markdown('<div class="chart-container">', unsafe_allow_html=True)
-        st.subheader("📊 按产品类型划分的销售额")
-        # 按产品类型聚合销售额（降序排列）
-        category_sales = filtered_df.groupby("category")["revenue"].sum().sort_values(ascending=False).reset_index()
-        # 绘制柱状图
-        st.bar_chart(
-            category_sales,
-            x="category",
+        st.subheader(f"📊 按产品类型划分的销售额{suffix}")
+        # 按产品类型聚合的销售额（降序排列）
+        category_sales = summary["category_sales"]
+        if approximate:
+            st.altair_chart(approx_bar_chart(category_sales, "category", sort=list(category_sales["category"])), use_container_width=True)
+        elif cross is not None:
+            st.altair_chart(
+                selectable_bar_chart(category_sales, "category", cross["category"], sort=list(category_sales["category"])),
+                use_container_width=True,
+                key=CROSS_FILTER_CHARTS["category"],
+                on_select=lambda: store_chart_selection("category"),
+            )
+        else:
+            # 绘制柱状图
+            st.bar_chart(
+                category_sales,
+                x="category",
+                y="revenue",
+                color="#007bff",
+                use_container_width=True
+            )
+        st.markdown('</div>', unsafe_allow_html=True)
+
+    # 图表3：销售额趋势（按日/按周）
+    if "daily_sales" in summary:
+        st.markdown('<div class="chart-container">', unsafe_allow_html=True)
+        st.subheader(f"📈 销售额趋势（{granularity}）{suffix}")
+        trend = trend_series(summary["daily_sales"], granularity)
+        st.line_chart(
+            trend,
+            x="date",
             y="revenue",
             color="#007bff",
             use_container_width=True
@@ -213,57 +1915,195 @@ def generate_charts(filtered_df):
 
 
 # 6. 主函数（整合所有功能+侧边栏筛选）
-def main():
-    # 标题
-    st.markdown('<h1 class="main-title">📊 销售仪表板</h1>', unsafe_allow_html=True)
-
-    # 加载数据
-    df = load_excel_data()
-    if df.empty:
-        return  # 数据为空时终止运行
-
-    # 筛选后的数据副本
-    df_filtered = df.copy()
-
-    # 侧边栏筛选器（匹配效果图的3个筛选项）
+def sidebar_filters(options, min_date=None, max_date=None):
+    """
+    侧边栏筛选器（匹配效果图的3个筛选项 + 日期范围）
+    options：{筛选维度: 可选取值}；返回 (selections, date_range)，选中全部日期时date_range为None
+    """
     st.sidebar.header("🔍 请筛选数据：")
 
     # 筛选1：城市（默认全选）
-    city_options = df["city"].unique()
+    city_options = options["city"]
     selected_cities = st.sidebar.multiselect(
         "选择城市：",
         options=city_options,
         default=city_options
     )
-    df_filtered = df_filtered[df_filtered["city"].isin(selected_cities)]
 
     # 筛选2：顾客类型（默认全选）
-    customer_options = df["customer_type"].unique()
+    customer_options = options["customer_type"]
     selected_customers = st.sidebar.multiselect(
         "选择顾客类型：",
         options=customer_options,
         default=customer_options
     )
-    df_filtered = df_filtered[df_filtered["customer_type"].isin(selected_customers)]
 
     # 筛选3：性别（默认全选）
-    gender_options = df["gender"].unique()
+    gender_options = options["gender"]
     selected_genders = st.sidebar.multiselect(
         "选择性别：",
         options=gender_options,
         default=gender_options
     )
-    df_filtered = df_filtered[df_filtered["gender"].isin(selected_genders)]
+
+    # 筛选4：日期范围（默认全部日期）
+    date_range = None
+    if min_date is not None and min_date < max_date:
+        start_date, end_date = st.sidebar.slider(
+            "选择日期范围：",
+            min_value=min_date,
+            max_value=max_date,
+            value=(min_date, max_date),
+            format="YYYY-MM-DD"
+        )
+        if (start_date, end_date) != (min_date, max_date):
+            date_range = (start_date, end_date)
+
+    selections = {
+        "city": selected_cities,
+        "customer_type": selected_customers,
+        "gender": selected_genders,
+    }
+    return selections, date_range
+
+
+def show_dashboard(summary, granularity, kpi_slot, chart_slot, timings):
+    """应用图表点选（交叉筛选）后，在占位容器中生成KPI和图表"""
+    # 图表点选（交叉筛选）：在 小时×产品类型 网格上重新汇总
+    cross = get_cross_filter()
+    with timed(timings, "交叉筛选"):
+        view = cross_filter_summary(summary, cross)
+
+    # 生成KPI和图表（筛选后的数据）
+    with timed(timings, "generate_kpi"):
+        with kpi_slot.container():
+            generate_kpi(view)
+            show_cross_filter(view, cross)
+    with timed(timings, "generate_charts"):
+        with chart_slot.container():
+            generate_charts(view, granularity, cross)
+
+
+def main():
+    # 标题
+    st.markdown('<h1 class="main-title">📊 销售仪表板</h1>', unsafe_allow_html=True)
+
+    timings = []  # 本次运行各阶段耗时
+
+    if PARQUET_DATASET:
+        main_out_of_core(timings)
+        return
+
+    # 加载数据
+    with timed(timings, "load_excel_data"):
+        df, version = load_excel_data()
+    if df.empty:
+        return  # 数据为空时终止运行
+
+    # 侧边栏筛选器
+    dates = df["date"].to_numpy()
+    n_valid = count_valid_dates(dates)
+    min_date = max_date = None
+    if n_valid:
+        min_date, max_date = pd.Timestamp(dates[0]).date(), pd.Timestamp(dates[n_valid - 1]).date()
+    options = {dim: df[dim].unique() for dim in FILTER_DIMENSIONS}
+    selections, date_range = sidebar_filters(options, min_date, max_date)
+
+    rows = None  # None表示不按日期筛选
+    anchor = max_date  # 环比截至的日期：日期范围的结束日
+    if date_range is not None:
+        # 数据已按日期排序：二分查找得到连续的行区间，无需逐行比较
+        with timed(timings, "筛选-日期区间"):
+            rows = date_slice(dates, *date_range)
+        anchor = date_range[1]
+
+    # 趋势图的时间粒度
+    granularity = st.sidebar.radio("销售额趋势：", TREND_GRANULARITY, horizontal=True)
+
+    # 大数据集且结果未缓存时：先用分层样本显示近似结果，精确结果算完后在原位置替换
+    kpi_slot, chart_slot = st.empty(), st.empty()
+    if cached_summary(version, selections, rows) is None and use_progressive(df, version, rows):
+        with timed(timings, "渐进-样本估计"):
+            estimate = estimate_summary(load_sales_sample(version), selections, rows)
+        with timed(timings, "渐进-近似渲染"):
+            with kpi_slot.container():
+                generate_kpi(estimate)
+            with chart_slot.container():
+                generate_charts(estimate, granularity)
+
+    summary = get_summary(df, version, selections, rows, timings)
 
     # 筛选后数据量提示
     st.sidebar.markdown("---")
-    st.sidebar.info(f"筛选后记录数：{len(df_filtered)} 条")
+    st.sidebar.info(f"筛选后记录数：{summary['orders']} 条")
+    show_export(lambda fmt: export_filtered_rows(df, version, selections, rows, fmt))
 
-    # 生成KPI和图表（筛选后的数据）
-    generate_kpi(df_filtered)
-    generate_charts(df_filtered)
+    show_dashboard(summary, granularity, kpi_slot, chart_slot, timings)
+
+    # 环比（本周/本月 vs 上周/上月），按侧边栏筛选，不受图表点选影响
+    if anchor is not None:
+        with timed(timings, "环比-前缀和"):
+            prefix_index = load_prefix_index(version)
+            if prefix_index is not None:
+                generate_period_kpis(prefix_index, selections, anchor)
+
+    # 耗时明细：侧边栏展示 + 追加到本地日志
+    show_timings(timings)
+    log_timings(timings, rows=len(df), selected_rows=summary["orders"], date_filtered=rows is not None)
+
+
+def main_out_of_core(timings):
+    """外存模式：数据不读入内存，筛选和汇总都扫描磁盘上的Parquet数据集（界面与内存模式相同）"""
+    version = parquet_dataset_version()
+    if version is None:
+        st.error(f"❌ 未找到Parquet数据集：{PARQUET_DATASET}")
+        st.info("💡 可先运行 python a11.py --build-dataset <目录> 把Excel/CSV转换为数据集")
+        return
+    with timed(timings, "打开数据集"):
+        dataset = open_sales_dataset(version)
+        meta = load_dataset_meta(version)
+    st.success(f"✅ 外存模式：共{meta['n_rows']}条销售记录（{len(dataset.files)}个Parquet文件，按需扫描）")
+
+    # 侧边栏筛选器（可选取值来自数据集扫描）
+    days = meta["days"]
+    min_date = max_date = None
+    if len(days):
+        min_date, max_date = pd.Timestamp(days[0]).date(), pd.Timestamp(days[-1]).date()
+    options = {dim: [v for v in meta["labels"][dim] if not pd.isna(v)] for dim in FILTER_DIMENSIONS}
+    selections, date_range = sidebar_filters(options, min_date, max_date)
+    anchor = date_range[1] if date_range is not None else max_date
+
+    # 趋势图的时间粒度
+    granularity = st.sidebar.radio("销售额趋势：", TREND_GRANULARITY, horizontal=True)
+
+    kpi_slot, chart_slot = st.empty(), st.empty()
+    summary = get_scan_summary(dataset, meta, version, selections, date_range, timings)
+
+    # 筛选后数据量提示
+    st.sidebar.markdown("---")
+    st.sidebar.info(f"筛选后记录数：{summary['orders']} 条")
+    show_export(lambda fmt: export_scanned_rows(dataset, meta, selections, date_range, fmt))
+
+    show_dashboard(summary, granularity, kpi_slot, chart_slot, timings)
+
+    # 环比：前缀和索引在扫描元数据时一并生成
+    if anchor is not None and meta["prefix_index"] is not None:
+        with timed(timings, "环比-前缀和"):
+            generate_period_kpis(meta["prefix_index"], selections, anchor)
+
+    show_timings(timings)
+    log_timings(
+        timings, rows=meta["n_rows"], selected_rows=summary["orders"],
+        date_filtered=date_range is not None, out_of_core=True,
+    )
 
 
 # 7. 运行入口
+# python a11.py --build-dataset <目录>：把数据源转换为按城市分区的Parquet数据集，
+# 之后用 A11_PARQUET_DATASET=<目录> streamlit run a11.py 以外存模式运行
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) == 3 and sys.argv[1] == "--build-dataset":
+        n_files = write_parquet_dataset(DATA_SOURCE, sys.argv[2])
+        print(f"已转换{n_files}个文件到 {sys.argv[2]}")
+    else:
+        main()
@@ -0,0 +1,236 @@
+# a11.py 销售仪表板的性能基准（脱离Streamlit运行）
+# 用法：
+#   python a11_bench.py                                  # 默认 1万/10万/100万 行
+#   python a11_bench.py --rows 10000 10000000 --output bench.json
+#   python a11_bench.py --baseline bench.json            # 与上一次的报告对比
+# 每个数据规模在独立的子进程中运行，峰值内存（peak RSS）互不影响
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from datetime import date, time as dt_time
+
+import numpy as np
+import pandas as pd
+
+# 与Excel原始表头一致（a11.COLUMN_MAPPING的键）
+SOURCE_COLUMNS = ["订单号", "分店", "城市", "顾客类型", "性别", "产品类型", "单价", "数量", "总价", "日期", "时间", "评分"]
+BRANCH_CITY = {"1号店": "太原", "2号店": "大同", "3号店": "临汾"}
+CATEGORIES = ["健康美容", "电子配件", "家居生活", "运动旅行", "食品饮料", "时尚配饰"]
+DEFAULT_ROWS = [10_000, 100_000, 1_000_000]
+XLSX_MAX_ROWS = 100_000  # 超过该行数改用CSV（写大Excel很慢，且Excel单表上限约104万行）
+
+# 有代表性的筛选组合（与侧边栏一致），各跑一遍取平均
+BENCH_SELECTIONS = [
+    {},  # 全选
+    {"city": ["太原"]},
+    {"customer_type": ["会员用户"]},
+    {"city": ["太原", "大同"], "gender": ["女性"]},
+]
+
+
+def generate_synthetic_sales(n_rows, seed=0, start=date(2022, 1, 1), days=1095):
+    """生成与supermarket_sales.xlsx同结构的模拟销售数据（原始中文表头，时间为datetime.time）"""
+    rng = np.random.default_rng(seed)
+    branches = rng.choice(list(BRANCH_CITY), n_rows)
+    unit_price = np.round(rng.uniform(10, 100, n_rows), 2)
+    quantity = rng.integers(1, 11, n_rows)
+    # 营业时间10点到20点，每分钟一个取值（与样例数据一致）
+    minutes = rng.integers(10 * 60, 21 * 60, n_rows)
+    time_lookup = np.array([dt_time(m // 60, m % 60) for m in range(24 * 60)], dtype=object)
+    return pd.DataFrame({
+        "订单号": [f"{a:03d}-{b:02d}-{c:04d}" for a, b, c in zip(
+            rng.integers(100, 1000, n_rows), rng.integers(0, 100, n_rows), rng.integers(0, 10000, n_rows))],
+        "分店": branches,
+        "城市": pd.Series(branches).map(BRANCH_CITY).to_numpy(),
+        "顾客类型": rng.choice(["会员用户", "普通用户"], n_rows),
+        "性别": rng.choice(["女性", "男性"], n_rows),
+        "产品类型": rng.choice(CATEGORIES, n_rows),
+        "单价": unit_price,
+        "数量": quantity,
+        "总价": np.round(unit_price * quantity * 1.05, 2),
+        "日期": pd.Timestamp(start) + pd.to_timedelta(rng.integers(0, days, n_rows), unit="D"),
+        "时间": time_lookup[minutes],
+        "评分": np.round(rng.uniform(4, 10, n_rows), 1),
+    }, columns=SOURCE_COLUMNS)
+
+
+def write_sales_xlsx(df_raw, path):
+    """按样例文件的版式写Excel：第1行标题，第2行列名（write_only模式逐行写入）"""
+    import openpyxl
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("销售数据")
+    sheet.append(["模拟销售数据"])
+    sheet.append(SOURCE_COLUMNS)
+    for row in df_raw.itertuples(index=False):
+        sheet.append([value.to_pydatetime() if isinstance(value, pd.Timestamp) else value for value in row])
+    workbook.save(path)
+
+
+def _timeit(func, repeat=1):
+    """返回 (最后一次的结果, 平均耗时秒)"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return result, (time.perf_counter() - start) / repeat
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024  # macOS单位是字节，Linux是KB
+
+
+def _import_a11():
+    """无界面导入a11（屏蔽Streamlit在bare模式下的提示）"""
+    import streamlit  # noqa: F401
+    for name in list(logging.root.manager.loggerDict):
+        if name.startswith("streamlit"):
+            logging.getLogger(name).setLevel(logging.ERROR)
+    import a11
+    return a11
+
+
+def _legacy_filter_and_aggregate(df, selections):
+    """优化前的做法：df.copy() + 3次isin + sum/mean + 2次groupby（作为对照）"""
+    df_filtered = df.copy()
+    for column in ("city", "customer_type", "gender"):
+        if column in selections:
+            df_filtered = df_filtered[df_filtered[column].isin(selections[column])]
+    df_filtered["revenue"].sum()
+    df_filtered["rating"].mean()
+    df_filtered["revenue"].mean()
+    df_filtered.groupby("hour", observed=True)["revenue"].sum()
+    df_filtered.groupby("category", observed=True)["revenue"].sum().sort_values(ascending=False)
+
+
+def run_size(n_rows, workdir, xlsx_max_rows=XLSX_MAX_ROWS, seed=0):
+    """在当前进程中跑一个数据规模，返回该规模的指标"""
+    a11 = _import_a11()
+    a11.SNAPSHOT_DIR = os.path.join(workdir, f"cache_{n_rows}")  # 快照写到临时目录
+
+    df_raw = generate_synthetic_sales(n_rows, seed)
+    if n_rows <= xlsx_max_rows:
+        source, path = "xlsx", os.path.join(workdir, f"sales_{n_rows}.xlsx")
+        write_sales_xlsx(df_raw, path)
+    else:
+        source, path = "csv", os.path.join(workdir, f"sales_{n_rows}.csv")
+        df_raw.to_csv(path, index=False)
+    del df_raw
+
+    result = {"rows": n_rows, "source": source}
+
+    # 1. 冷启动解析（无快照）与快照读取
+    df, result["ingest_s"] = _timeit(lambda: a11.load_sales_file(path))
+    result["ingest_rows_per_s"] = n_rows / result["ingest_s"]
+    _, result["snapshot_load_s"] = _timeit(lambda: a11.load_snapshot(path))
+    result["memory_mb"] = df.memory_usage(index=False, deep=True).sum() / 1024 ** 2
+
+    # 2. 每个数据版本只做一次的准备：排序、立方体、位图、内核编码
+    df, result["sort_s"] = _timeit(lambda: a11.sort_by_date(df))
+    cube, result["cube_build_s"] = _timeit(lambda: a11.build_sales_cube(df))
+    bitmap_index, result["bitmap_build_s"] = _timeit(lambda: a11.build_bitmap_index(df))
+    inputs, result["kernel_inputs_s"] = _timeit(lambda: a11.build_kernel_inputs(df))
+
+    # 3. 每次筛选的耗时（毫秒，多个筛选组合取平均）
+    options = {dim: list(df[dim].unique()) for dim in a11.FILTER_DIMENSIONS}
+    selection_sets = [{dim: values.get(dim, options[dim]) for dim in a11.FILTER_DIMENSIONS} for values in BENCH_SELECTIONS]
+    dates = df["date"].to_numpy()
+    first_month = a11.date_slice(dates, dates[0], pd.Timestamp(dates[0]) + pd.Timedelta(days=30))
+
+    def per_selection(func, repeat=3):
+        return 1000 * np.mean([_timeit(lambda: func(sel), repeat)[1] for sel in selection_sets])
+
+    result["cube_query_ms"] = per_selection(lambda sel: a11.summarize_aggregate(a11.query_sales_cube(cube, sel)))
+    result["bitmap_filter_ms"] = per_selection(lambda sel: a11.select_rows(bitmap_index, sel))
+    result["kernel_aggregate_ms"] = per_selection(
+        lambda sel: a11.summarize_aggregate(a11.aggregate_sales(inputs, a11.select_rows(bitmap_index, sel))))
+    result["date_range_ms"] = per_selection(
+        lambda sel: a11.summarize_aggregate(a11.aggregate_sales(inputs, a11.select_rows(bitmap_index, sel, first_month), first_month)))
+    result["legacy_ms"] = per_selection(lambda sel: _legacy_filter_and_aggregate(df, sel), repeat=1)
+
+    result["peak_rss_mb"] = _peak_rss_mb()
+    return result
+
+
+def run_benchmark(row_counts, xlsx_max_rows=XLSX_MAX_ROWS, seed=0):
+    """每个规模用spawn启动的独立子进程运行，保证峰值内存互不干扰"""
+    context = multiprocessing.get_context("spawn")
+    results = []
+    with tempfile.TemporaryDirectory(prefix="a11_bench_") as workdir:
+        for n_rows in row_counts:
+            with context.Pool(1) as pool:
+                result = pool.apply(run_size, (n_rows, workdir, xlsx_max_rows, seed))
+            print(f"✅ {n_rows:>10,} 行完成", file=sys.stderr)
+            results.append(result)
+    return results
+
+
+REPORT_COLUMNS = [
+    ("rows", "行数", "{:,}"),
+    ("source", "格式", "{}"),
+    ("ingest_rows_per_s", "解析(行/秒)", "{:,.0f}"),
+    ("snapshot_load_s", "快照读取(s)", "{:.3f}"),
+    ("cube_build_s", "立方体(s)", "{:.3f}"),
+    ("cube_query_ms", "立方体查询(ms)", "{:.2f}"),
+    ("bitmap_filter_ms", "位图筛选(ms)", "{:.2f}"),
+    ("kernel_aggregate_ms", "筛选+汇总(ms)", "{:.2f}"),
+    ("date_range_ms", "日期区间(ms)", "{:.2f}"),
+    ("legacy_ms", "优化前(ms)", "{:.2f}"),
+    ("memory_mb", "数据内存(MB)", "{:.1f}"),
+    ("peak_rss_mb", "峰值RSS(MB)", "{:.0f}"),
+]
+
+
+def format_report(results, baseline=None):
+    """输出Markdown表格；提供基准报告时，追加与基准相比的耗时倍数（>1表示变慢）"""
+    lines = [
+        "| " + " | ".join(title for _, title, _ in REPORT_COLUMNS) + " |",
+        "|" + "---|" * len(REPORT_COLUMNS),
+    ]
+    for result in results:
+        lines.append("| " + " | ".join(fmt.format(result[key]) for key, _, fmt in REPORT_COLUMNS) + " |")
+
+    if baseline:
+        previous = {item["rows"]: item for item in baseline}
+        lines += ["", "与基准对比（当前/基准）："]
+        for result in results:
+            base = previous.get(result["rows"])
+            if base is None:
+                continue
+            ratios = [
+                f"{title}×{result[key] / base[key]:.2f}"
+                for key, title, _ in REPORT_COLUMNS
+                if key not in ("rows", "source") and base.get(key)
+            ]
+            lines.append(f"- {result['rows']:,} 行：" + "，".join(ratios))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="a11.py 销售仪表板性能基准")
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS, help="数据规模（行数），可写多个")
+    parser.add_argument("--xlsx-max-rows", type=int, default=XLSX_MAX_ROWS, help="不超过该行数时用xlsx，否则用csv")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="把结果保存为JSON，供下次 --baseline 对比")
+    parser.add_argument("--baseline", help="上一次保存的JSON报告")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.rows, args.xlsx_max_rows, args.seed)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    print(format_report(results, baseline))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"created": time.strftime("%Y-%m-%d %H:%M:%S"), "results": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,16 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
+import io
+import os
+import sys
+import json
+import time
+import codecs
+import hashlib
 try:
+    import joblib
+    import sklearn
     from sklearn.model_selection import train_test_split
     from sklearn.ensemble import RandomForestRegressor
     from sklearn.preprocessing import LabelEncoder
@@ -18,6 +27,13 @@ try:
 except ImportError:
     PLOTLY_AVAILABLE = False
 
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
 # ===================== 页面配置 =====================
 st.set_page_config(
     page_title="🏥 医疗费用预测系统",
@@ -89,46 +105,137 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# ===================== 数据与模型文件 =====================
+DATA_PATH = 'insurance-chinese.csv'
+MODEL_DIR = 'models'  # 离线训练的模型文件目录（python medical_predictor_simple.py --train 生成）
+MODEL_META_PATH = os.path.join(MODEL_DIR, 'medical_rf.json')  # 当前模型版本的说明：文件名、指标、编码、训练数据标识
+FEATURES = ['age', 'sex_encoded', 'bmi', 'children', 'smoker_encoded', 'region_encoded']
+CSV_COLUMNS = ['age', 'sex', 'bmi', 'children', 'smoker', 'region', 'charges']
+INPUT_COLUMNS = CSV_COLUMNS[:6]
+CHINESE_COLUMNS = {'年龄': 'age', '性别': 'sex', 'BMI': 'bmi', '子女数量': 'children',
+                   '是否吸烟': 'smoker', '区域': 'region', '医疗费用': 'charges'}  # insurance-chinese.csv 的表头
+BATCH_CHUNK_ROWS = 10_000  # 批量预测时每次调用 rf_model.predict 的行数
+CSV_ENCODINGS = ['utf-8-sig', 'gbk', 'gb18030']  # utf-8-sig兼容无BOM的UTF-8；gb18030是gbk/gb2312的超集
+ENCODING_SAMPLE_BYTES = 64 * 1024  # 判断编码只看文件开头的字节
+NORMALIZED_CACHE_PATH = os.path.join('.medical_cache', 'insurance.parquet')  # 规范化数据缓存：英文列名+标签编码，UTF-8
+
 # ===================== 数据加载和预处理 =====================
-@st.cache_data
-def load_and_preprocess_data():
-    """加载并预处理医疗保险数据"""
+def detect_encoding(sample, encodings=CSV_ENCODINGS):
+    """根据字节样本判断编码（样本末尾被截断的多字节字符不算解码失败）"""
+    for encoding in encodings:
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return None
+
+def read_csv_text(path, encodings=CSV_ENCODINGS):
+    """读取一次文件字节，按样本判断的编码解码一次、解析一次，返回 (DataFrame, 编码)"""
+    with open(path, 'rb') as f:
+        return parse_csv_bytes(f.read(), encodings)
+
+def parse_csv_bytes(raw, encodings=CSV_ENCODINGS):
+    """
+    按样本判断的编码解码CSV字节并解析，返回 (DataFrame, 编码)
+    样本之后才出现无法解码的字节时，才在内存中改用其他编码
+    """
+    detected = detect_encoding(raw[:ENCODING_SAMPLE_BYTES], encodings)
+    candidates = ([detected] if detected else []) + [e for e in encodings if e != detected]
+    for encoding in candidates:
+        try:
+            text = raw.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+        return pd.read_csv(io.StringIO(text)), encoding
+    raise UnicodeDecodeError(candidates[-1], raw[:1], 0, 1, "无法识别CSV文件编码")
+
+def read_normalized_cache(fingerprint):
+    """
+    读取与当前CSV一致的规范化缓存，返回 (DataFrame, 各字段取值顺序)
+    缓存缺失、损坏或CSV已更新时返回 (None, None)
+    """
+    if not PYARROW_AVAILABLE or not os.path.exists(NORMALIZED_CACHE_PATH):
+        return None, None
     try:
-        # 尝试不同编码读取CSV文件
-        encodings = ['utf-8', 'gbk', 'gb2312', 'utf-8-sig']
-        df = None
-        
-        for encoding in encodings:
-            try:
-                df = pd.read_csv('insurance-chinese.csv', encoding=encoding)
-                st.success(f"✅ 成功读取CSV文件 (编码: {encoding})")
-                break
-            except (UnicodeDecodeError, FileNotFoundError):
-                continue
-        
-        if df is None:
+        metadata = pq.read_schema(NORMALIZED_CACHE_PATH).metadata or {}
+        if metadata.get(b'medical_source', b'').decode('utf-8') != fingerprint:
+            return None, None
+        classes = json.loads(metadata[b'medical_encoders'])
+        df = pq.read_table(NORMALIZED_CACHE_PATH, memory_map=True).to_pandas()
+    except (OSError, ValueError, KeyError, pa.ArrowException):
+        return None, None
+    return df, classes
+
+def save_normalized_cache(df, classes, fingerprint):
+    """把规范化后的数据写成Parquet缓存（先写临时文件再原子替换），失败不影响主流程"""
+    if not PYARROW_AVAILABLE:
+        return False
+    try:
+        os.makedirs(os.path.dirname(NORMALIZED_CACHE_PATH), exist_ok=True)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        metadata = dict(table.schema.metadata or {})
+        metadata[b'medical_source'] = fingerprint.encode('utf-8')
+        metadata[b'medical_encoders'] = json.dumps(classes, ensure_ascii=False).encode('utf-8')
+        table = table.replace_schema_metadata(metadata)
+        tmp_path = f"{NORMALIZED_CACHE_PATH}.{os.getpid()}.tmp"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, NORMALIZED_CACHE_PATH)
+    except (OSError, pa.ArrowException):
+        return False
+    return True
+
+def label_encoder_from_classes(classes):
+    """按保存的取值顺序还原LabelEncoder（无需重新fit）"""
+    le = LabelEncoder()
+    le.classes_ = np.array(classes, dtype=object)
+    return le
+
+@st.cache_data(max_entries=2)
+def load_and_preprocess_data(fingerprint):
+    """
+    加载并预处理医疗保险数据
+    fingerprint：调用前取得的CSV标识（dataset_fingerprint()），作为缓存的键，CSV变化后自动重新加载；
+    读取期间文件被替换时，下次调用标识不同，会再次加载
+    优先读取规范化缓存（已是英文列名和标签编码）；缓存失效时才解码、解析CSV并重新编码，然后更新缓存
+    """
+    try:
+        if not os.path.exists(DATA_PATH):
             st.info("📊 CSV文件未找到，使用示例数据")
             return generate_sample_data()
         
-        # 重命名列名为英文（便于处理）
-        df.columns = ['age', 'sex', 'bmi', 'children', 'smoker', 'region', 'charges']
-        
-        # 数据清洗
-        df = df.dropna()
-        
-        if SKLEARN_AVAILABLE:
-            # 标签编码
-            le_sex = LabelEncoder()
-            le_smoker = LabelEncoder()
-            le_region = LabelEncoder()
+        df, classes = read_normalized_cache(fingerprint)
+        if df is not None:
+            st.success("✅ 成功读取数据缓存")
+        else:
+            df, encoding = read_csv_text(DATA_PATH)
+            st.success(f"✅ 成功读取CSV文件 (编码: {encoding})")
             
-            df['sex_encoded'] = le_sex.fit_transform(df['sex'])
-            df['smoker_encoded'] = le_smoker.fit_transform(df['smoker'])
-            df['region_encoded'] = le_region.fit_transform(df['region'])
+            # 重命名列名为英文（便于处理）
+            df.columns = CSV_COLUMNS
             
-            return df, le_sex, le_smoker, le_region
-        else:
-            return df, None, None, None
+            # 数据清洗
+            df = df.dropna().reset_index(drop=True)
+            
+            if SKLEARN_AVAILABLE:
+                # 标签编码
+                le_sex = LabelEncoder()
+                le_smoker = LabelEncoder()
+                le_region = LabelEncoder()
+                
+                df['sex_encoded'] = le_sex.fit_transform(df['sex'])
+                df['smoker_encoded'] = le_smoker.fit_transform(df['smoker'])
+                df['region_encoded'] = le_region.fit_transform(df['region'])
+                
+                classes = encoder_classes(le_sex, le_smoker, le_region)
+                save_normalized_cache(df, classes, fingerprint)
+        
+        df.attrs['fingerprint'] = fingerprint
+        if SKLEARN_AVAILABLE:
+            return (df, label_encoder_from_classes(classes['sex']),
+                    label_encoder_from_classes(classes['smoker']),
+                    label_encoder_from_classes(classes['region']))
+        return df[CSV_COLUMNS], None, None, None
             
     except Exception as e:
         st.warning(f"⚠️ 数据加载失败: {e}")
@@ -166,52 +273,220 @@ def generate_sample_data():
     
     df['charges'] = np.maximum(df['charges'], 1000)
     
+    df.attrs['fingerprint'] = f"sample-{n_samples}-42"
     return df, None, None, None
 
 # ===================== 机器学习模型训练 =====================
-@st.cache_resource
-def train_random_forest_model(df):
-    """训练随机森林模型"""
-    if df is None or not SKLEARN_AVAILABLE:
+def fit_random_forest(df):
+    """训练并评估随机森林模型（不依赖Streamlit，离线训练也使用）"""
+    # 准备特征和目标变量
+    X = df[FEATURES]
+    y = df['charges']
+    
+    # 分割数据
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    
+    # 训练随机森林模型
+    rf_model = RandomForestRegressor(n_estimators=100, random_state=42)
+    rf_model.fit(X_train, y_train)
+    
+    # 模型评估
+    rf_pred = rf_model.predict(X_test)
+    
+    metrics = {
+        'MAE': float(mean_absolute_error(y_test, rf_pred)),
+        'RMSE': float(np.sqrt(mean_squared_error(y_test, rf_pred))),
+        'R2': float(r2_score(y_test, rf_pred))
+    }
+    
+    return rf_model, metrics
+
+@st.cache_resource(max_entries=2)
+def train_random_forest_model(fingerprint, _df):
+    """
+    训练随机森林模型（模型文件缺失或过期时的备用方案）
+    缓存只按数据集标识查找：_df 以下划线开头，Streamlit不对它求哈希，命中缓存的耗时与数据量无关
+    """
+    if _df is None or not SKLEARN_AVAILABLE:
         return None, None
     
     try:
-        # 准备特征和目标变量
-        features = ['age', 'sex_encoded', 'bmi', 'children', 'smoker_encoded', 'region_encoded']
-        X = df[features]
-        y = df['charges']
-        
-        # 分割数据
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-        
-        # 训练随机森林模型
-        rf_model = RandomForestRegressor(n_estimators=100, random_state=42)
-        rf_model.fit(X_train, y_train)
-        
-        # 模型评估
-        rf_pred = rf_model.predict(X_test)
-        
-        metrics = {
-            'MAE': mean_absolute_error(y_test, rf_pred),
-            'RMSE': np.sqrt(mean_squared_error(y_test, rf_pred)),
-            'R2': r2_score(y_test, rf_pred)
-        }
-        
-        return rf_model, metrics
+        return fit_random_forest(_df)
         
     except Exception as e:
         st.error(f"❌ 随机森林模型训练失败: {e}")
         return None, None
+
+# ===================== 模型文件（离线训练，带版本） =====================
+def data_signature(path=DATA_PATH):
+    """训练数据的标识：大小和修改时间（文件不存在时返回None）"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return {'path': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def dataset_fingerprint(path=DATA_PATH):
+    """数据集标识的字符串形式（加载数据时计算一次，保存在 df.attrs['fingerprint']）"""
+    return json.dumps(data_signature(path), sort_keys=True)
+
+def file_sha256(path):
+    """文件内容的SHA-256（修改时间变了但内容没变时，模型仍然有效）"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def encoder_classes(le_sex, le_smoker, le_region):
+    """把LabelEncoder保存为各字段的取值顺序（编码 = 取值在列表中的下标）"""
+    return {
+        'sex': [str(c) for c in le_sex.classes_],
+        'smoker': [str(c) for c in le_smoker.classes_],
+        'region': [str(c) for c in le_region.classes_],
+    }
+
+def _write_atomic(path, write):
+    """先写临时文件再替换，避免其他进程读到写了一半的文件"""
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def save_model_artifact(rf_model, metrics, encoders, fingerprint, data_path=DATA_PATH, model_dir=MODEL_DIR):
+    """
+    保存带版本的模型文件：models/medical_rf-<时间>-<数据哈希>.joblib（不压缩，加载时可以内存映射），
+    以及说明文件 medical_rf.json（当前版本、指标、编码、训练数据标识）；旧版本的模型文件随后删除
+    fingerprint：训练所用数据的标识（df.attrs['fingerprint']）；与当前CSV不一致时说明训练后CSV已变化，
+    不保存并返回None，避免把旧数据训练的模型标记为新数据的版本
+    """
+    if fingerprint != dataset_fingerprint(data_path):
+        return None
+    data_hash = file_sha256(data_path)
+    if fingerprint != dataset_fingerprint(data_path):
+        return None  # 计算哈希期间CSV被修改
+    os.makedirs(model_dir, exist_ok=True)
+    version = f"{time.strftime('%Y%m%d%H%M%S')}-{data_hash[:8]}"
+    artifact = f"medical_rf-{version}.joblib"
+    _write_atomic(os.path.join(model_dir, artifact), lambda path: joblib.dump(rf_model, path))
+
+    meta = {
+        'version': version,
+        'artifact': artifact,
+        'trained_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'sklearn_version': sklearn.__version__,
+        'features': FEATURES,
+        'metrics': metrics,
+        'encoders': encoders,
+        'data': {**data_signature(data_path), 'sha256': data_hash},
+    }
+    meta_path = os.path.join(model_dir, os.path.basename(MODEL_META_PATH))
+    def write_meta(path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+    _write_atomic(meta_path, write_meta)
+
+    # 清理旧版本（正在被其他进程内存映射的文件可能删除失败，下次再清理）
+    for name in os.listdir(model_dir):
+        if name.startswith('medical_rf-') and name.endswith('.joblib') and name != artifact:
+            try:
+                os.remove(os.path.join(model_dir, name))
+            except OSError:
+                pass
+    return meta
+
+def is_artifact_current(meta, data_path=DATA_PATH):
+    """模型是否仍然对应当前的训练数据和scikit-learn版本"""
+    signature = data_signature(data_path)
+    if signature is None or meta.get('sklearn_version') != sklearn.__version__:
+        return False
+    trained = meta.get('data', {})
+    if (trained.get('size'), trained.get('mtime_ns')) == (signature['size'], signature['mtime_ns']):
+        return True
+    # 修改时间变了（如重新检出），内容没变时仍然有效
+    return trained.get('size') == signature['size'] and trained.get('sha256') == file_sha256(data_path)
+
+def model_artifact_key(data_path=DATA_PATH):
+    """模型缓存的键：说明文件与训练数据的修改时间和大小（只需两次stat，不读取文件内容）"""
+    try:
+        meta_stat = os.stat(MODEL_META_PATH)
+    except OSError:
+        return None
+    return (meta_stat.st_mtime_ns, meta_stat.st_size, dataset_fingerprint(data_path))
+
+@st.cache_resource(show_spinner="正在加载模型...", max_entries=2)
+def load_model_artifact(key):
+    """
+    按键加载离线训练的模型（每个进程每个版本只加载一次）；文件缺失、损坏或已过期时返回None
+    mmap_mode只是让joblib直接从文件映射数组、省去读取缓冲；scikit-learn还原每棵树时会把节点和取值数组
+    复制到进程私有内存，所以模型内存并不在进程间共享，每个进程各占一份
+    """
+    if key is None or not SKLEARN_AVAILABLE:
+        return None
+    try:
+        with open(MODEL_META_PATH, encoding='utf-8') as f:
+            meta = json.load(f)
+        if not is_artifact_current(meta):
+            return None
+        rf_model = joblib.load(os.path.join(MODEL_DIR, meta['artifact']), mmap_mode='r')
+    except (OSError, ValueError, KeyError):
+        return None
+    return {'model': rf_model, 'meta': meta}
+
+def get_model(df, le_sex, le_smoker, le_region):
+    """
+    优先使用离线训练的模型；模型文件缺失或过期时才现场训练，并写入新的模型文件供之后的进程直接加载
+    返回 (rf_model, metrics, encoders, 版本说明)
+    """
+    artifact = load_model_artifact(model_artifact_key())
+    if artifact is not None:
+        meta = artifact['meta']
+        return artifact['model'], meta['metrics'], meta['encoders'], f"离线模型 {meta['version']}"
+
+    rf_model, metrics = train_random_forest_model(df.attrs.get('fingerprint'), df)
+    if rf_model is None or le_sex is None:
+        return rf_model, metrics, None, "现场训练"
+    encoders = encoder_classes(le_sex, le_smoker, le_region)
+    try:
+        save_model_artifact(rf_model, metrics, encoders, df.attrs.get('fingerprint'))
+    except OSError:
+        pass  # 目录不可写时只在本进程内使用
+    return rf_model, metrics, encoders, "现场训练"
+
+def train_and_save():
+    """离线训练入口：训练、评估并写入带版本的模型文件"""
+    if not SKLEARN_AVAILABLE:
+        print("未安装scikit-learn，无法训练")
+        return 1
+    df, le_sex, le_smoker, le_region = load_and_preprocess_data(dataset_fingerprint())
+    if le_sex is None:
+        print(f"未找到训练数据：{DATA_PATH}")
+        return 1
+    rf_model, metrics = fit_random_forest(df)
+    meta = save_model_artifact(rf_model, metrics, encoder_classes(le_sex, le_smoker, le_region), df.attrs.get('fingerprint'))
+    if meta is None:
+        print(f"训练期间 {DATA_PATH} 已变化，未保存模型，请重新训练")
+        return 1
+    print(f"模型已保存：{os.path.join(MODEL_DIR, meta['artifact'])}")
+    print(f"MAE={metrics['MAE']:.2f}  RMSE={metrics['RMSE']:.2f}  R2={metrics['R2']:.3f}")
+    return 0
 # ===================== 预测函数 =====================
-def predict_medical_cost(age, sex, bmi, children, smoker, region, rf_model=None):
-    """使用随机森林模型预测，如果模型不可用则使用规则引擎"""
+def predict_medical_cost(age, sex, bmi, children, smoker, region, rf_model=None, encoders=None):
+    """
+    使用随机森林模型预测，如果模型不可用则使用规则引擎
+    encoders：训练时各字段的取值顺序，保证编码与训练一致
+    """
     if rf_model is not None and SKLEARN_AVAILABLE:
         try:
             # 编码输入数据
-            sex_encoded = 1 if sex == '男性' else 0
-            smoker_encoded = 1 if smoker == '是' else 0
-            region_map = {'东南部': 0, '西南部': 1, '西北部': 2, '东北部': 3}
-            region_encoded = region_map.get(region, 0)
+            if encoders is not None:
+                sex_encoded = encoders['sex'].index(sex)
+                smoker_encoded = encoders['smoker'].index(smoker)
+                region_encoded = encoders['region'].index(region)
+            else:
+                sex_encoded = 1 if sex == '男性' else 0
+                smoker_encoded = 1 if smoker == '是' else 0
+                region_map = {'东南部': 0, '西南部': 1, '西北部': 2, '东北部': 3}
+                region_encoded = region_map.get(region, 0)
             
             # 准备预测数据
             input_data = np.array([[age, sex_encoded, bmi, children, smoker_encoded, region_encoded]])
@@ -227,9 +502,18 @@ def predict_medical_cost(age, sex, bmi, children, smoker, region, rf_model=None)
         # 使用规则引擎作为备用
         return predict_with_rules(age, sex, bmi, children, smoker, region), "规则引擎"
 
+# 规则引擎参数（标量版与向量化版共用）
+RULE_BASE_COST = 5000
+RULE_REGION_FACTORS = {
+    '东南部': 1000, '西南部': 800, 
+    '西北部': 600, '东北部': 1200
+}
+RULE_DEFAULT_REGION_FACTOR = 800
+RULE_COLUMNS = ['基础费用', '年龄因子', 'BMI因子', '吸烟因子', '子女因子', '性别因子', '区域因子', '预测费用']
+
 def predict_with_rules(age, sex, bmi, children, smoker, region):
     """基于规则的医疗费用预测（备用方案）"""
-    base_cost = 5000
+    base_cost = RULE_BASE_COST
     age_factor = age * 100
     
     if bmi > 30:
@@ -243,11 +527,7 @@ def predict_with_rules(age, sex, bmi, children, smoker, region):
     children_factor = children * 1000
     sex_factor = 500 if sex == '男性' else 0
     
-    region_factors = {
-        '东南部': 1000, '西南部': 800, 
-        '西北部': 600, '东北部': 1200
-    }
-    region_factor = region_factors.get(region, 800)
+    region_factor = RULE_REGION_FACTORS.get(region, RULE_DEFAULT_REGION_FACTOR)
     
     total_cost = (base_cost + age_factor + bmi_factor + 
                  smoker_factor + children_factor + 
@@ -255,6 +535,131 @@ def predict_with_rules(age, sex, bmi, children, smoker, region):
     
     return max(total_cost, 1000)
 
+def predict_with_rules_batch(age, sex, bmi, children, smoker, region):
+    """
+    向量化的规则引擎：参数为等长的数组/Series，返回各项费用构成和预测费用（RULE_COLUMNS）
+    各项按与 predict_with_rules 相同的顺序相加，结果与逐行调用完全一致
+    """
+    age = np.asarray(age, dtype=float)
+    bmi = np.asarray(bmi, dtype=float)
+    children = np.asarray(children, dtype=float)
+    sex = np.asarray(sex, dtype=object)
+    smoker = np.asarray(smoker, dtype=object)
+    
+    base_cost = np.full(len(age), float(RULE_BASE_COST))
+    age_factor = age * 100
+    bmi_factor = np.where(bmi > 30, (bmi - 30) * 500, np.where(bmi < 18.5, (18.5 - bmi) * 300, 0.0))
+    smoker_factor = np.where(smoker == '是', 15000.0, 0.0)
+    children_factor = children * 1000
+    sex_factor = np.where(sex == '男性', 500.0, 0.0)
+    # 区域查表：不在表中的区域（编码-1）取最后一项，即默认值
+    region_codes = pd.Categorical(np.asarray(region, dtype=object), categories=list(RULE_REGION_FACTORS)).codes
+    region_factor = np.append(np.array(list(RULE_REGION_FACTORS.values()), dtype=float),
+                              RULE_DEFAULT_REGION_FACTOR)[region_codes]
+    
+    total_cost = (base_cost + age_factor + bmi_factor + 
+                 smoker_factor + children_factor + 
+                 sex_factor + region_factor)
+    
+    return pd.DataFrame(dict(zip(RULE_COLUMNS, [
+        base_cost, age_factor, bmi_factor, smoker_factor, children_factor,
+        sex_factor, region_factor, np.maximum(total_cost, 1000)])))
+
+# ===================== 批量预测 =====================
+def read_batch_file(name, raw):
+    """读取上传的CSV/Excel（CSV沿用单次编码识别），返回原始DataFrame"""
+    if name.lower().endswith('.xlsx'):
+        return pd.read_excel(io.BytesIO(raw))
+    return parse_csv_bytes(raw)[0]
+
+def normalize_batch_frame(df_raw):
+    """
+    把上传的数据整理为 age/sex/bmi/children/smoker/region 六列（中英文表头均可）
+    数值列无法解析时记为NaN，分类列缺失时记为空字符串；缺少必需列时抛出ValueError
+    """
+    df = df_raw.rename(columns=lambda c: CHINESE_COLUMNS.get(str(c).strip(), str(c).strip()))
+    missing = [c for c in INPUT_COLUMNS if c not in df.columns]
+    if missing:
+        names = {v: k for k, v in CHINESE_COLUMNS.items()}
+        raise ValueError("缺少必需列：" + "、".join(f"{names[c]}({c})" for c in missing))
+    df = df[INPUT_COLUMNS].copy()
+    for column in ('age', 'bmi', 'children'):
+        df[column] = pd.to_numeric(df[column], errors='coerce')
+    for column in ('sex', 'smoker', 'region'):
+        df[column] = df[column].astype('string').str.strip().fillna('').astype(object)
+    return df
+
+def encode_batch(df, encoders=None):
+    """
+    向量化编码（与 predict_medical_cost 的编码一致），返回 (特征DataFrame, 有效行掩码)
+    取值不在训练数据中或为空的行、数值缺失或不大于0的行视为无效
+    """
+    if encoders is not None:
+        codes = {column: pd.Categorical(df[column], categories=encoders[column]).codes
+                 for column in ('sex', 'smoker', 'region')}
+    else:
+        codes = {
+            'sex': np.where(df['sex'] == '男性', 1, 0),
+            'smoker': np.where(df['smoker'] == '是', 1, 0),
+            'region': df['region'].map({'东南部': 0, '西南部': 1, '西北部': 2, '东北部': 3}).fillna(0).to_numpy(),
+        }
+    X = pd.DataFrame({
+        'age': df['age'].to_numpy(dtype=float),
+        'sex_encoded': codes['sex'],
+        'bmi': df['bmi'].to_numpy(dtype=float),
+        'children': df['children'].to_numpy(dtype=float),
+        'smoker_encoded': codes['smoker'],
+        'region_encoded': codes['region'],
+    }, columns=FEATURES)
+    valid = (X[['age', 'bmi', 'children']].notna().all(axis=1) & (X['age'] > 0) & (X['bmi'] > 0)
+             & (X[['sex_encoded', 'smoker_encoded', 'region_encoded']] >= 0).all(axis=1)
+             & (df[['sex', 'smoker', 'region']] != '').all(axis=1)).to_numpy()
+    return X, valid
+
+def iter_batch_predictions(df, rf_model=None, encoders=None, chunk_rows=BATCH_CHUNK_ROWS):
+    """
+    分块预测：每块调用一次 rf_model.predict（无模型时用向量化规则引擎，并附上各项费用构成），
+    逐块产出 (已完成行数, 该块结果DataFrame)，结果与逐行调用 predict_medical_cost 一致
+    """
+    X, valid = encode_batch(df, encoders)
+    for start in range(0, len(df), chunk_rows):
+        end = min(start + chunk_rows, len(df))
+        chunk_valid = valid[start:end]
+        if rf_model is not None:
+            prediction = np.full(end - start, np.nan)
+            if chunk_valid.any():
+                prediction[chunk_valid] = np.maximum(rf_model.predict(X.iloc[start:end][chunk_valid]), 1000)
+            chunk = pd.DataFrame({'预测费用': prediction})
+        else:
+            rows = df.iloc[start:end]
+            chunk = predict_with_rules_batch(rows['age'], rows['sex'], rows['bmi'],
+                                             rows['children'], rows['smoker'], rows['region'])
+            chunk.loc[~chunk_valid] = np.nan
+            chunk = chunk[RULE_COLUMNS[-1:] + RULE_COLUMNS[:-1]]  # 预测费用放在最前
+        chunk = chunk.round(2)
+        chunk['使用模型'] = np.where(chunk_valid, "随机森林" if rf_model is not None else "规则引擎", "")
+        chunk['说明'] = np.where(chunk_valid, "", "数据无效")
+        chunk.index = df.index[start:end]
+        yield end, chunk
+
+def run_batch_prediction(df_raw, rf_model=None, encoders=None, on_progress=None, chunk_rows=BATCH_CHUNK_ROWS):
+    """
+    批量预测并逐块写出结果CSV（原始列 + 预测结果，utf-8-sig便于Excel打开）
+    返回 (结果CSV字节, 预测结果DataFrame)
+    """
+    df = normalize_batch_frame(df_raw)
+    out = io.BytesIO()
+    results = []
+    for done, chunk in iter_batch_predictions(df, rf_model, encoders, chunk_rows):
+        start = done - len(chunk)
+        pd.concat([df_raw.iloc[start:done], chunk], axis=1).to_csv(
+            out, index=False, header=start == 0, encoding='utf-8-sig' if start == 0 else 'utf-8')
+        results.append(chunk)
+        if on_progress is not None:
+            on_progress(done, len(df))
+    result = pd.concat(results) if results else pd.DataFrame(columns=['预测费用', '使用模型', '说明'])
+    return out.getvalue(), result
+
 # ===================== 页面函数 =====================
 def show_introduction():
     """显示简介页面"""
@@ -294,12 +699,13 @@ def show_prediction():
     """)
     
     # 加载数据和训练模型
-    df, le_sex, le_smoker, le_region = load_and_preprocess_data()
+    df, le_sex, le_smoker, le_region = load_and_preprocess_data(dataset_fingerprint())
     
+    encoders = None
     if SKLEARN_AVAILABLE:
-        rf_model, metrics = train_random_forest_model(df)
+        rf_model, metrics, encoders, model_version = get_model(df, le_sex, le_smoker, le_region)
         if rf_model is not None:
-            st.success("🌲 随机森林模型训练完成！")
+            st.success(f"🌲 随机森林模型已就绪（{model_version}）")
             
             # 显示模型性能
             with st.expander("📊 模型性能指标"):
@@ -343,7 +749,7 @@ def show_prediction():
         if submitted:
             if age > 0 and bmi > 0:
                 # 使用随机森林进行预测
-                prediction, model_name = predict_medical_cost(age, sex, bmi, children, smoker, region, rf_model)
+                prediction, model_name = predict_medical_cost(age, sex, bmi, children, smoker, region, rf_model, encoders)
                 
                 # 显示预测结果
                 st.markdown("---")
@@ -374,20 +780,13 @@ def show_prediction():
                 # 如果使用规则引擎，显示费用构成
                 if model_name == "规则引擎":
                     with st.expander("💡 费用构成分析"):
-                        base_cost = 5000
-                        age_factor = age * 100
-                        bmi_factor = max(0, (bmi - 30) * 500) if bmi > 30 else max(0, (18.5 - bmi) * 300) if bmi < 18.5 else 0
-                        smoker_factor = 15000 if smoker == '是' else 0
-                        children_factor = children * 1000
+                        breakdown = predict_with_rules_batch([age], [sex], [bmi], [children], [smoker], [region]).iloc[0]
                         
-                        st.write(f"**基础费用**: ¥{base_cost:,.2f}")
-                        st.write(f"**年龄因子**: ¥{age_factor:,.2f}")
-                        if bmi_factor > 0:
-                            st.write(f"**BMI因子**: ¥{bmi_factor:,.2f}")
-                        if smoker_factor > 0:
-                            st.write(f"**吸烟因子**: ¥{smoker_factor:,.2f}")
-                        if children_factor > 0:
-                            st.write(f"**子女因子**: ¥{children_factor:,.2f}")
+                        st.write(f"**基础费用**: ¥{breakdown['基础费用']:,.2f}")
+                        st.write(f"**年龄因子**: ¥{breakdown['年龄因子']:,.2f}")
+                        for name in RULE_COLUMNS[2:-1]:
+                            if breakdown[name] > 0:
+                                st.write(f"**{name}**: ¥{breakdown[name]:,.2f}")
                 elif model_name == "随机森林":
                     with st.expander("🌲 随机森林预测说明"):
                         st.markdown("""
@@ -403,6 +802,66 @@ def show_prediction():
             else:
                 st.error("请输入有效的年龄和BMI值")
 
+def show_batch_prediction():
+    """批量预测页面：上传CSV/Excel，分块预测并下载结果"""
+    st.markdown("## 批量预测")
+    
+    df, le_sex, le_smoker, le_region = load_and_preprocess_data(dataset_fingerprint())
+    rf_model, encoders = None, None
+    if SKLEARN_AVAILABLE:
+        rf_model, _, encoders, model_version = get_model(df, le_sex, le_smoker, le_region)
+    st.caption(f"使用模型: {'随机森林（' + model_version + '）' if rf_model is not None else '规则引擎'}")
+    
+    st.markdown("上传包含 **年龄、性别、BMI、子女数量、是否吸烟、区域** 列的CSV或Excel文件（英文列名 age/sex/bmi/children/smoker/region 亦可）。")
+    uploaded = st.file_uploader("选择文件", type=['csv', 'xlsx'])
+    if uploaded is None:
+        return
+    
+    # 结果按文件缓存在会话中，下载或其他操作引起的重跑不会重新预测
+    result = st.session_state.get('batch_result')
+    if result is None or result['file_id'] != uploaded.file_id:
+        if not st.button("开始批量预测", type="primary"):
+            return
+        try:
+            df_raw = read_batch_file(uploaded.name, uploaded.getvalue())
+        except (ValueError, UnicodeDecodeError) as e:
+            st.error(f"❌ 文件读取失败: {e}")
+            return
+        progress = st.progress(0.0, text="正在预测...")
+        start_time = time.perf_counter()
+        try:
+            data, predictions = run_batch_prediction(
+                df_raw, rf_model, encoders,
+                on_progress=lambda done, total: progress.progress(done / total, text=f"已完成 {done:,} / {total:,} 行"))
+        except ValueError as e:
+            progress.empty()
+            st.error(f"❌ {e}")
+            return
+        result = {
+            'file_id': uploaded.file_id,
+            'name': os.path.splitext(uploaded.name)[0] + '_预测结果.csv',
+            'data': data,
+            'preview': pd.concat([df_raw.head(100), predictions.head(100)], axis=1),
+            'rows': len(predictions),
+            'invalid': int((predictions['说明'] != "").sum()),
+            'mean': predictions['预测费用'].mean(),
+            'seconds': time.perf_counter() - start_time,
+        }
+        st.session_state['batch_result'] = result
+        progress.empty()
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("预测行数", f"{result['rows']:,}")
+    with col2:
+        st.metric("无效行数", f"{result['invalid']:,}")
+    with col3:
+        st.metric("平均预测费用", f"¥{result['mean']:,.2f}" if result['rows'] > result['invalid'] else "-")
+    st.caption(f"耗时 {result['seconds']:.2f} 秒，下方仅预览前100行")
+    st.dataframe(result['preview'], use_container_width=True)
+    st.download_button("⬇️ 下载预测结果", result['data'], file_name=result['name'],
+                       mime="text/csv", on_click="ignore")
+
 # ===================== 主应用 =====================
 def main():
     # 初始化session state
@@ -418,6 +877,9 @@ def main():
     if st.sidebar.button("💰 预测分析", use_container_width=True):
         st.session_state.current_page = '预测分析'
     
+    if st.sidebar.button("📦 批量预测", use_container_width=True):
+        st.session_state.current_page = '批量预测'
+    
     st.sidebar.markdown("---")
     st.sidebar.markdown(f"**当前页面**: {st.session_state.current_page}")
     
@@ -426,6 +888,11 @@ def main():
         show_introduction()
     elif st.session_state.current_page == '预测分析':
         show_prediction()
+    elif st.session_state.current_page == '批量预测':
+        show_batch_prediction()
 
+# python medical_predictor_simple.py --train：离线训练并写入模型文件
 if __name__ == "__main__":
+    if "--train" in sys.argv[1:]:
+        sys.exit(train_and_save())
     main()
\ No newline at end of file
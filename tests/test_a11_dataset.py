@@ -0,0 +1,32 @@
+# a11.py Parquet数据集：重新转换源文件时，数据中已不存在的城市分区不能残留旧文件
+import glob
+import os
+import sys
+
+import pyarrow.dataset as ds
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import a11  # noqa: E402
+from a11_bench import generate_synthetic_sales  # noqa: E402
+
+
+def test_reconvert_removes_vanished_city(tmp_path, monkeypatch):
+    monkeypatch.setattr(a11, "SNAPSHOT_DIR", str(tmp_path / "cache"))
+    path = str(tmp_path / "sales.csv")
+    dataset_dir = str(tmp_path / "dataset")
+    df_raw = generate_synthetic_sales(600, seed=8)
+    df_raw.to_csv(path, index=False)
+    a11.write_parquet_dataset(path, dataset_dir)
+    assert glob.glob(os.path.join(dataset_dir, "city=*", "sales.parquet"))
+
+    # 同一个源文件去掉一个城市后重新转换
+    dropped = df_raw["城市"].iloc[0]
+    remaining = df_raw[df_raw["城市"] != dropped]
+    remaining.to_csv(path, index=False)
+    a11.write_parquet_dataset(path, dataset_dir)
+
+    table = ds.dataset(dataset_dir, format="parquet", partitioning="hive").to_table()
+    assert table.num_rows == len(remaining)
+    assert dropped not in set(table.column("city").to_pylist())
+    assert table.column("revenue").to_numpy().sum() == pytest.approx(remaining["总价"].sum())
@@ -0,0 +1,77 @@
+# a11.py 导出明细：下载按钮的回调经Streamlit的延迟下载流程执行（与点击下载按钮时相同）
+import io
+import json
+import os
+import sys
+
+import pandas as pd
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pytest
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import a11  # noqa: E402
+from a11_bench import generate_synthetic_sales  # noqa: E402
+
+SELECTIONS = {"city": ["太原", "大同"], "customer_type": ["会员用户", "普通用户"], "gender": ["女性"]}
+
+
+@pytest.fixture(scope="module")
+def sales(tmp_path_factory):
+    """2000行模拟数据：返回 (数据版本, 共享的只读数据)；快照写到临时目录，模块结束后恢复SNAPSHOT_DIR"""
+    workdir = tmp_path_factory.mktemp("a11")
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(a11, "SNAPSHOT_DIR", str(workdir / "cache"))
+        path = str(workdir / "sales.csv")
+        generate_synthetic_sales(2000, seed=1).to_csv(path, index=False)
+        version = a11.dataset_version(path)
+        yield version, a11._load_excel_data(version)
+
+
+def run_deferred(data_callable, mime, file_name):
+    """按下载按钮的方式注册回调并执行，返回Streamlit实际发送的字节"""
+    storage = MemoryMediaFileStorage("/media")
+    manager = MediaFileManager(storage)
+    file_id = manager.add_deferred(data_callable, mime, "download_button", file_name)
+    url = manager.execute_deferred(file_id)
+    return storage.get_file(os.path.basename(url)).content
+
+
+def expected_rows(df):
+    mask = df["city"].isin(SELECTIONS["city"]) & df["gender"].isin(SELECTIONS["gender"])
+    return df[mask].reset_index(drop=True)
+
+
+@pytest.mark.parametrize("label", list(a11.EXPORT_FORMATS))
+def test_export_filtered_rows_download(sales, label):
+    version, df = sales
+    fmt, mime = a11.EXPORT_FORMATS[label]
+    data = run_deferred(lambda: a11.export_filtered_rows(df, version, SELECTIONS, None, fmt), mime, f"sales.{fmt}")
+    if fmt == "csv":
+        assert data.startswith(b"\xef\xbb\xbf")
+        exported = pd.read_csv(io.BytesIO(data), encoding="utf-8-sig")
+    else:
+        exported = pq.read_table(io.BytesIO(data)).to_pandas()
+    expected = expected_rows(df)
+    assert list(exported.columns) == [a11.EXPORT_COLUMNS.get(c, c) for c in df.columns]
+    assert len(exported) == len(expected) > 0
+    assert exported["总价"].sum() == pytest.approx(expected["revenue"].sum())
+
+
+@pytest.mark.parametrize("label", list(a11.EXPORT_FORMATS))
+def test_export_scanned_rows_download(sales, tmp_path, label):
+    version, df = sales
+    a11.write_parquet_dataset(json.loads(version)["path"], str(tmp_path))
+    dataset = ds.dataset(str(tmp_path), format="parquet", partitioning="hive")
+    meta = a11.scan_dataset_meta(dataset)
+    fmt, mime = a11.EXPORT_FORMATS[label]
+    data = run_deferred(lambda: a11.export_scanned_rows(dataset, meta, SELECTIONS, None, fmt), mime, f"sales.{fmt}")
+    if fmt == "csv":
+        exported = pd.read_csv(io.BytesIO(data), encoding="utf-8-sig")
+    else:
+        exported = pq.read_table(io.BytesIO(data)).to_pandas()
+    expected = expected_rows(df)
+    assert len(exported) == len(expected) > 0
+    assert exported["总价"].sum() == pytest.approx(expected["revenue"].sum())
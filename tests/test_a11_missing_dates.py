@@ -0,0 +1,91 @@
+# a11.py 空日期：加载时无法识别的日期记为NaT，立方体、内核与增量合并三种汇总路径都不能因此出错
+import os
+import sys
+import time
+
+import openpyxl
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import a11  # noqa: E402
+from a11_bench import generate_synthetic_sales, write_sales_xlsx  # noqa: E402
+
+N_MISSING = 10
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.setattr(a11, "SNAPSHOT_DIR", str(tmp_path / "cache"))
+    return tmp_path
+
+
+def sales_with_missing_dates(n_rows, seed):
+    """模拟数据，前N_MISSING行的日期为空"""
+    df_raw = generate_synthetic_sales(n_rows, seed=seed, days=60)
+    dates = df_raw["日期"].astype(object)
+    dates.iloc[:N_MISSING] = None
+    df_raw["日期"] = dates
+    return df_raw
+
+
+def all_selections(df):
+    return {dim: list(df[dim].unique()) for dim in a11.FILTER_DIMENSIONS}
+
+
+def assert_daily_sales(summary, df):
+    """每日销售额与按日期分组的结果一致，空日期不出现在趋势数据中"""
+    expected = df[df["date"].notna()].groupby("date", observed=True)["revenue"].sum()
+    daily = summary["daily_sales"].set_index("date")["revenue"]
+    assert daily.index.notna().all()
+    assert daily[daily > 0].to_dict() == pytest.approx(expected[expected > 0].to_dict())
+    assert summary["orders"] == len(df)
+
+
+def load(path):
+    version = a11.dataset_version(path)
+    return version, a11._load_excel_data(version)
+
+
+def test_cube_path(workdir):
+    path = str(workdir / "sales.csv")
+    sales_with_missing_dates(500, seed=2).to_csv(path, index=False)
+    version, df = load(path)
+    assert df["date"].isna().sum() == N_MISSING
+    assert a11.load_daily_cube(version) is not None
+    assert_daily_sales(a11.compute_summary(df, version, all_selections(df)), df)
+
+
+def test_kernel_path(workdir, monkeypatch):
+    monkeypatch.setattr(a11, "CUBE_MAX_CELLS", 0)
+    path = str(workdir / "sales.csv")
+    sales_with_missing_dates(500, seed=3).to_csv(path, index=False)
+    version, df = load(path)
+    assert a11.load_sales_cube(version) is None
+    assert_daily_sales(a11.compute_summary(df, version, all_selections(df)), df)
+
+
+def test_incremental_merge_path(workdir):
+    path = str(workdir / "sales.xlsx")
+    write_sales_xlsx(sales_with_missing_dates(500, seed=4), path)
+    version, df = load(path)
+    a11.compute_summary(df, version, all_selections(df))
+    assert a11.load_prefix_index(version) is not None
+
+    # 末尾追加20行新数据，其中N_MISSING行日期为空
+    workbook = openpyxl.load_workbook(path)
+    sheet = workbook.worksheets[0]
+    for row in sales_with_missing_dates(20, seed=5).itertuples(index=False):
+        sheet.append([value.to_pydatetime() if isinstance(value, pd.Timestamp) else value for value in row])
+    workbook.save(path)
+    time.sleep(0.01)
+
+    version, df = load(path)
+    assert "increment" in df.attrs
+    assert df["date"].isna().sum() == 2 * N_MISSING
+    assert_daily_sales(a11.compute_summary(df, version, all_selections(df)), df)
+    prefix_index = a11.load_prefix_index(version)
+    full_index = a11.build_prefix_index(df)
+    assert prefix_index["n_days"] == full_index["n_days"]
+    for name, values in full_index["measures"].items():
+        assert prefix_index["measures"][name] == pytest.approx(values)
@@ -0,0 +1,57 @@
+# a11.py 增量刷新：只有单纯在末尾追加行时才在旧快照上拼接，任何旧行被改动都要全量重建
+import os
+import sys
+
+import openpyxl
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import a11  # noqa: E402
+from a11_bench import generate_synthetic_sales, write_sales_xlsx  # noqa: E402
+
+
+@pytest.fixture
+def workbook_path(tmp_path, monkeypatch):
+    """300行模拟数据的Excel，已加载一次（生成快照）"""
+    monkeypatch.setattr(a11, "SNAPSHOT_DIR", str(tmp_path / "cache"))
+    path = str(tmp_path / "sales.xlsx")
+    write_sales_xlsx(generate_synthetic_sales(300, seed=6), path)
+    a11.load_sales_file(path)
+    return path
+
+
+def edit_workbook(path, edit):
+    workbook = openpyxl.load_workbook(path)
+    edit(workbook.worksheets[0])
+    workbook.save(path)
+
+
+def test_appended_rows_are_merged(workbook_path):
+    edit_workbook(workbook_path, lambda sheet: sheet.append(["999-99-9999", "1号店", "太原", "会员用户", "女性",
+                                                              "健康美容", 10.0, 2, 21.0, None, "9:15", 8.0]))
+    df = a11.refresh_from_snapshot(workbook_path)
+    assert df is not None and len(df) == 301
+    assert df.attrs["increment"]["base_rows"] == 300
+
+
+@pytest.mark.parametrize("cell", ["I3", "I150", "I301"])
+def test_edited_old_row_forces_rebuild(workbook_path, cell):
+    def edit(sheet):
+        sheet[cell] = 1.0
+    edit_workbook(workbook_path, edit)
+    assert a11.refresh_from_snapshot(workbook_path) is None
+    assert a11.load_sales_file(workbook_path)["revenue"].min() == 1.0
+
+
+def test_reads_first_sheet_not_active(tmp_path, monkeypatch):
+    """与pd.read_excel一致读第一个工作表：保存时活动的是说明页也照常加载"""
+    monkeypatch.setattr(a11, "SNAPSHOT_DIR", str(tmp_path / "cache"))
+    path = str(tmp_path / "sales.xlsx")
+    write_sales_xlsx(generate_synthetic_sales(300, seed=7), path)
+
+    def add_notes(sheet):
+        notes = sheet.parent.create_sheet("说明")
+        notes.append(["本表为说明"])
+        sheet.parent.active = notes
+    edit_workbook(path, add_notes)
+    assert len(a11.load_sales_file(path)) == 300
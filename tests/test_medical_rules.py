@@ -0,0 +1,45 @@
+# medical_predictor_simple.py 规则引擎：向量化版本与逐行调用 predict_with_rules 的结果必须完全一致
+import itertools
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import medical_predictor_simple as mp  # noqa: E402
+
+SEXES = ['男性', '女性', '其他', '']
+SMOKERS = ['是', '否', '']
+REGIONS = list(mp.RULE_REGION_FACTORS) + ['northeast', '']
+# BMI分段的边界（18.5、30）及其两侧
+BMIS = [12.0, 18.4, 18.5, 18.6, 25.0, 29.99, 30.0, 30.01, 45.5]
+
+
+def assert_matches_scalar(rows):
+    age, sex, bmi, children, smoker, region = (list(column) for column in zip(*rows))
+    result = mp.predict_with_rules_batch(age, sex, bmi, children, smoker, region)
+    assert list(result.columns) == mp.RULE_COLUMNS
+    expected = [mp.predict_with_rules(*row) for row in rows]
+    assert result['预测费用'].tolist() == expected
+
+
+def test_grid_of_boundaries_and_unknown_categories():
+    rows = [(age, sex, bmi, children, smoker, region) for age, sex, bmi, children, smoker, region in itertools.product(
+        [0, 18, 64], SEXES, BMIS, [0, 3], SMOKERS, REGIONS)]
+    assert_matches_scalar(rows)
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_random_rows(seed):
+    rng = np.random.default_rng(seed)
+    n = 2000
+    rows = list(zip(
+        rng.integers(0, 100, n).tolist(),
+        rng.choice(SEXES, n).tolist(),
+        np.round(rng.uniform(10, 50, n), 2).tolist(),
+        rng.integers(0, 6, n).tolist(),
+        rng.choice(SMOKERS, n).tolist(),
+        rng.choice(REGIONS, n).tolist(),
+    ))
+    assert_matches_scalar(rows)